@@ -0,0 +1,64 @@
+"""Compares the costs of an event with a complete copy of the component tree
+(``copy.deepcopy``) and with the copy on write history.
+
+Usage::
+
+    $ python benchmarks/bench_history.py
+"""
+import copy
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from django.conf import settings  # noqa
+settings.configure()
+
+from cba import components  # noqa
+from cba.history import History  # noqa
+from cba.history import Journal  # noqa
+
+SIZES = (100, 1000, 5000)
+CHANGED = (1, 10, 100)
+NUMBER = 20
+
+
+def create_tree(size):
+    return components.Group(id="root", initial_components=[
+        components.TextInput(id="input-{}".format(i)) for i in range(size)
+    ])
+
+
+def event_deepcopy(root, changed):
+    root = copy.deepcopy(root)
+    for i in range(changed):
+        root._components["input-{}".format(i)].value = "changed"
+    return root
+
+
+def event_history(history, changed):
+    state = history.state
+    root = history.checkout(state)
+    with Journal() as journal:
+        for i in range(changed):
+            root._components["input-{}".format(i)].value = history.state
+    history.commit(journal, state, create_state=True)
+
+
+def main():
+    print("{:>8} {:>8} {:>14} {:>14}".format("size", "changed", "deepcopy (ms)", "history (ms)"))
+    for size in SIZES:
+        for changed in CHANGED:
+            if changed > size:
+                continue
+            root = create_tree(size)
+            history = History(create_tree(size))
+            deepcopy_time = timeit.timeit(lambda: event_deepcopy(root, changed), number=NUMBER)
+            history_time = timeit.timeit(lambda: event_history(history, changed), number=NUMBER)
+            print("{:>8} {:>8} {:>14.3f} {:>14.3f}".format(
+                size, changed, deepcopy_time * 1000 / NUMBER, history_time * 1000 / NUMBER))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Compares the size and the costs of pickling a component tree with the
+compact state of ``Component.__getstate__`` and with the complete attributes.
+
+Usage::
+
+    $ python benchmarks/bench_pickle.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from django.conf import settings  # noqa
+settings.configure()
+
+from cba import base  # noqa
+from cba import components  # noqa
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+SIZES = (100, 1000, 5000)
+NUMBER = 10
+
+
+def create_tree(size):
+    return components.Group(id="root", initial_components=[
+        components.Group(initial_components=[
+            components.TextInput(label="Name {}".format(i)),
+            components.Button(value="Save"),
+        ])
+        for i in range(size // 3)
+    ])
+
+
+def measure(root):
+    data = pickle.dumps(root, pickle.HIGHEST_PROTOCOL)
+    dumps = timeit.timeit(lambda: pickle.dumps(root, pickle.HIGHEST_PROTOCOL), number=NUMBER) / NUMBER
+    loads = timeit.timeit(lambda: pickle.loads(data), number=NUMBER) / NUMBER
+    return len(data), dumps, loads
+
+
+def main():
+    print("{:>6} {:>24} {:>24}".format("size", "complete", "compact"))
+    print("{:>6} {:>8} {:>7} {:>7} {:>8} {:>7} {:>7}".format(
+        "", "bytes", "dumps", "loads", "bytes", "dumps", "loads"))
+
+    getstate = base.Component.__getstate__
+    setstate = base.Component.__setstate__
+
+    for size in SIZES:
+        root = create_tree(size)
+
+        del base.Component.__getstate__
+        del base.Component.__setstate__
+        complete = measure(root)
+
+        base.Component.__getstate__ = getstate
+        base.Component.__setstate__ = setstate
+        compact = measure(root)
+
+        print("{:>6} {:>8} {:>5.1f}ms {:>5.1f}ms {:>8} {:>5.1f}ms {:>5.1f}ms".format(
+            size,
+            complete[0], complete[1] * 1000, complete[2] * 1000,
+            compact[0], compact[1] * 1000, compact[2] * 1000,
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Compares rendering a table with ``render_to_string`` per component and with
+compiled templates, which render nested components within one context.
+
+Usage::
+
+    $ python benchmarks/bench_render.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from django.conf import settings  # noqa
+settings.configure(
+    INSTALLED_APPS=["cba"],
+    TEMPLATES=[{
+        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        "APP_DIRS": True,
+    }],
+    # The output is compared with render_to_string.
+    CBA_COLLAPSE_WHITESPACE=False,
+)
+
+import django  # noqa
+django.setup()
+
+from django.template.loader import render_to_string  # noqa
+
+from cba import base  # noqa
+from cba import components  # noqa
+
+ROWS = (50, 500)
+NUMBER = 10
+
+
+def create_table(rows):
+    data_provider = components.TableDataProvider()
+    data_provider.data = [
+        {"id": "row-{}".format(i), "data": ["Name {}".format(i), i, "Description {}".format(i)]}
+        for i in range(rows)
+    ]
+    table = components.Table(id="table", data_provider=data_provider)
+    table.load_data()
+    return table
+
+
+def main():
+    print("{:>6} {:>18} {:>18}".format("rows", "render_to_string", "compiled"))
+    for rows in ROWS:
+        table = create_table(rows)
+
+        base.render_template = render_to_string
+        expected = table.render()
+        old = timeit.timeit(table.render, number=NUMBER) / NUMBER
+
+        base.render_template = render_template
+        assert table.render() == expected
+        new = timeit.timeit(table.render, number=NUMBER) / NUMBER
+
+        print("{:>6} {:>16.2f}ms {:>16.2f}ms".format(rows, old * 1000, new * 1000))
+
+
+render_template = base.render_template
+
+if __name__ == "__main__":
+    main()
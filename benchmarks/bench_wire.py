@@ -0,0 +1,115 @@
+"""Measures the bytes on the wire per event, i.e. the size of the responses
+of ``CBAView.post``, with the steps of the response pipeline turned on one
+after another: collapsed whitespace, patches, the compact format and gzip.
+
+The events page through a table, sort it and change a text input.
+
+Usage::
+
+    $ python benchmarks/bench_wire.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from django.conf import settings  # noqa
+settings.configure(
+    INSTALLED_APPS=["cba"],
+    TEMPLATES=[{
+        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        "APP_DIRS": True,
+    }],
+    SESSION_ENGINE="django.contrib.sessions.backends.cache",
+    SESSION_SERIALIZER="django.contrib.sessions.serializers.PickleSerializer",
+    CBA_TREE_STORE="cba.stores.LocalTreeStore",
+)
+
+import django  # noqa
+django.setup()
+
+from django.contrib.sessions.backends.cache import SessionStore  # noqa
+from django.test import RequestFactory  # noqa
+
+import cba  # noqa
+from cba import base  # noqa
+from cba import components  # noqa
+
+ROWS = 200
+PAGINATION = 20
+
+EVENTS = [
+    {"handler": "handle_pagination", "component_id": "table", "component_value": "2"},
+    {"handler": "handle_pagination", "component_id": "table", "component_value": "3"},
+    {"handler": "handle_sort", "component_id": "table", "component_value": "1"},
+    {"handler": "handle_save", "component_id": "output", "name": "Jane"},
+    {"handler": "handle_save", "component_id": "output", "name": "John"},
+]
+
+
+class Root(components.Group):
+    def init_components(self):
+        data_provider = components.TableDataProvider()
+        data_provider.data = [
+            {"id": "row-{}".format(i), "data": ["Name {}".format(i), i, "Description {}".format(i)]}
+            for i in range(ROWS)
+        ]
+        self.initial_components = [
+            components.TextInput(id="name", label="Name"),
+            components.HTML(id="output"),
+            components.Table(
+                id="table", data_provider=data_provider, pagination=PAGINATION, sortable=True,
+                headers=["Name", "Number", "Description"],
+            ),
+        ]
+
+    def after_initial_components(self):
+        self.get_component("table").load_data()
+
+    @base.event_handler
+    def handle_save(self):
+        output = self.get_component("output")
+        output.content = "Hello {}".format(self.get_component("name").value)
+        output.refresh()
+
+
+def request(session, data=None):
+    if data is None:
+        result = RequestFactory().get("/")
+    else:
+        result = RequestFactory().post("/", data, HTTP_ACCEPT_ENCODING="gzip")
+    result.session = session
+    cba.set_request(result)
+    return result
+
+
+def measure(**options):
+    view = type("View", (base.CBAView,), dict(options, root=Root))
+    session = SessionStore()
+    view.as_view()(request(session))
+
+    sizes = []
+    for event in EVENTS:
+        data = dict(event, state="1", partial="true")
+        sizes.append(len(view.as_view()(request(session, data)).content))
+    return sizes
+
+
+def main():
+    steps = [
+        ("plain", False, dict(patch_responses=False, compress_min_bytes=None)),
+        ("collapsed", True, dict(patch_responses=False, compress_min_bytes=None)),
+        ("patches", True, dict(compress_min_bytes=None)),
+        ("compact", True, dict(compact_responses=True, compress_min_bytes=None)),
+        ("gzip", True, dict(compact_responses=True)),
+    ]
+
+    print("{:>10} {}".format("", " ".join("{:>8}".format("event {}".format(i + 1)) for i in range(len(EVENTS)))))
+    for name, collapse, options in steps:
+        settings.CBA_COLLAPSE_WHITESPACE = collapse
+        sizes = measure(**options)
+        print("{:>10} {}".format(name, " ".join("{:>8}".format(size) for size in sizes)))
+
+
+if __name__ == "__main__":
+    main()
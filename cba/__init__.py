@@ -1,11 +1,49 @@
 from threading import local
 
+try:
+    from contextvars import ContextVar
+except ImportError:
+    ContextVar = None
 
-_thread_locals = local()
+
+class ContextLocal(object):
+    """A value which is local to the current context. This is the asyncio
+    task (or thread) if ``contextvars`` is available (Python >= 3.7),
+    otherwise the thread.
+
+        name
+            The name of the value.
+    """
+    def __init__(self, name):
+        if ContextVar is not None:
+            self._var = ContextVar(name, default=None)
+        else:
+            self._var = None
+            self._local = local()
+
+    def get(self):
+        if self._var is not None:
+            return self._var.get()
+        return getattr(self._local, "value", None)
+
+    def set(self, value):
+        if self._var is not None:
+            self._var.set(value)
+        else:
+            self._local.value = value
+
+
+_request = ContextLocal("cba_request")
 
 
 def get_request():
-    return getattr(_thread_locals, 'request', None)
+    return _request.get()
+
+
+def set_request(request):
+    """Sets the current request, which is returned by ``get_request``.
+    """
+    _request.set(request)
 
 
 class RequestMiddleware(object):
@@ -24,4 +62,4 @@ class RequestMiddleware(object):
         return response
 
     def process_view(self, request, view_func, view_args, view_kwargs):
-        _thread_locals.request = request
+        set_request(request)
@@ -1,21 +1,105 @@
-import copy
+import itertools
 import json
 import logging
 import uuid
 from collections import OrderedDict
 
-from django.template.loader import render_to_string
-
+from django.conf import settings
 from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
 from django.shortcuts import render
+from django.utils import six
 from django.views.generic import View
 
 from cba import get_request
 
-from . utils import LazyEncoder
+from . history import History
+from . history import HistoryStore
+from . history import Journal
+from . history import UNTRACKED
+from . history import copy_state
+from . history import get_journal
+from . patch import SentHTML
+from . patch import get_ids
+from . patch import get_patch
+from . push import Mailbox
+from . push import get_pool
+from . push import run_work
+from . rendering import get_fingerprint
+from . rendering import NOT_RENDERED
+from . rendering import get_render_cache
+from . rendering import render_template
+from . utils import compress
+from . utils import dumps
 
 logger = logging.getLogger(__name__)
 
+# Attributes of components which are left out when they are pickled, if they
+# have their default value. Callables create the default value.
+PICKLE_DEFAULTS = {
+    "attributes": dict,
+    "cols": None,
+    "component_value": None,
+    "css_class": None,
+    "disabled": False,
+    "displayed": True,
+    "draggable": False,
+    "droppable": False,
+    "focus": False,
+    "handler": dict,
+    "initial_components": list,
+    "is_grid": False,
+    "javascript": "",
+    "parent": None,
+    "_appends": None,
+    "_dirty": None,
+    "_index": None,
+    "_messages": list,
+    "_pending": False,
+    "_updates": None,
+}
+
+# Attributes of components which are only used during an event. They are
+# never pickled.
+PICKLE_TRANSIENT = frozenset([
+    "element_id", "component_id", "source_id", "key_code", "_appends", "_dirty", "_messages", "_updates",
+])
+
+# Attributes of components which don't change their body, i.e. which keep the
+# body key (see TabItem).
+NOT_BODY = NOT_RENDERED | frozenset(["_pending", "active", "body_key", "component_value"])
+
+# The event handlers of component classes: class -> {name: method}
+_event_handlers = {}
+
+
+def event_handler(method):
+    """Registers the decorated method of a component as event handler. Only
+    registered methods can be called by events of the browser::
+
+        class MyGroup(components.Group):
+            @event_handler
+            def handle_save(self):
+                ...
+    """
+    method.is_event_handler = True
+    return method
+
+
+def get_event_handlers(cls):
+    """Returns the event handlers of the passed component class by name. The
+    handlers of a class are collected only once.
+    """
+    handlers = _event_handlers.get(cls)
+    if handlers is None:
+        names = set()
+        for klass in cls.__mro__:
+            for name, value in vars(klass).items():
+                if getattr(value, "is_event_handler", False):
+                    names.add(name)
+        handlers = _event_handlers[cls] = dict((name, getattr(cls, name)) for name in names)
+    return handlers
+
 
 class Component(object):
     """Base class of all components.
@@ -71,7 +155,28 @@ class Component(object):
             be a method of the component instance which has "catched" the
             event or one of it's parent components (handler with the prefix
             ``server``) or a javascript method ( handler with the prefix
-            ``client``).
+            ``client``). Server handlers must be registered with the
+            decorator ``event_handler``.
+
+            By default the browser only sends the values of inputs which have
+            been changed since the last request. Inputs which a server handler
+            needs in any case can be declared with the ``inputs`` option
+            (comma separated ids or ``*`` for all inputs), e.g.::
+
+                handlers = {
+                    "click": "server:handle_save;inputs=name,email",
+                }
+
+            Further options of server handlers are ``debounce`` (the event is
+            sent when the events pause for the given milliseconds),
+            ``throttle`` (the event is sent at most once within the given
+            milliseconds) and ``latest`` (a new event makes the browser
+            drop the messages of the request in flight of the same event and
+            element), e.g.::
+
+                handlers = {
+                    "keyup": "server:handle_search;debounce=300;latest",
+                }
 
         initial_components
             The initial sub components of this component.
@@ -93,14 +198,94 @@ class Component(object):
         remove_after_render
             If true the component is removed from the component tree after
             it has been rendered.
+
+        render_cache
+            If true the rendered HTML is cached by the fingerprint of the
+            component, i.e. its class, template, attributes and sub
+            components. The representations of the attributes must be
+            stable. Defaults to ``False``.
+
+        lazy
+            If true ``init_components`` is deferred until the component is
+            rendered, looks up a component (``get_component``) or handles an
+            event. Lookups through other components don't initialize it,
+            hence its sub components are only found after it has been
+            initialized. A lazy component which
+            is hidden (see ``is_hidden``) is rendered as placeholder
+            (``placeholder_template``), hence its sub components aren't
+            created before it is shown. Defaults to ``False``.
+
+        reactive_attributes
+            Attributes which are updated within the browser directly when
+            they are changed within an event, without rendering the
+            component. The browser needs an updater of the same name (see
+            ``CBA.updaters``). Only attributes which the template renders
+            may be reactive, as the browser would display changes which a
+            rendering wouldn't. Changes of components which are refreshed are
+            sent with their HTML.
     """
     template = None
     remove_after_render = False
+    render_cache = False
+    lazy = False
+    placeholder_template = "cba/components/placeholder.html"
+    reactive_attributes = frozenset(["displayed", "disabled", "css_class"])
+
+    def __new__(cls, *args, **kwargs):
+        component = super(Component, cls).__new__(cls)
+        journal = get_journal()
+        if journal is not None:
+            journal.created(component)
+        return component
+
+    def __setattr__(self, name, value):
+        journal = get_journal()
+        if journal is not None:
+            journal.touch(self, name, value)
+            if name in self.reactive_attributes:
+                self._update(name, value)
+        object.__setattr__(self, name, value)
+
+    def __getstate__(self):
+        """Returns the compact state of the component for pickling. Default
+        values and transient attributes are left out, the sub components are
+        stored as flat list of ids and components.
+        """
+        state = {}
+        for name, value in self.__dict__.items():
+            if name in PICKLE_TRANSIENT:
+                continue
+            if name in PICKLE_DEFAULTS:
+                default = PICKLE_DEFAULTS[name]
+                if callable(default):
+                    default = default()
+                if type(value) is type(default) and value == default:
+                    continue
+            state[name] = value
+
+        components = []
+        for id, component in self._components.items():
+            components.append(id)
+            components.append(component)
+        state["_components"] = components
+
+        return state
+
+    def __setstate__(self, state):
+        """Restores the component from the state of ``__getstate__``.
+        """
+        for name, default in PICKLE_DEFAULTS.items():
+            if name not in state:
+                state[name] = default() if callable(default) else default
+
+        components = state["_components"]
+        state["_components"] = OrderedDict(zip(components[::2], components[1::2]))
+        object.__setattr__(self, "__dict__", state)
 
     def __init__(self, id=None, component_value=None, attributes=None,
                  css_class=None, disabled=False, displayed=True, draggable=False,
                  droppable=False, handler=None, initial_components=None, cols=None,
-                 is_grid=False, javascript="", focus=False, *args, **kwargs):
+                 is_grid=False, javascript="", focus=False, lazy=None, *args, **kwargs):
         self.id = id or str(uuid.uuid4())
         self.component_value = component_value
         self.attributes = attributes or {}
@@ -121,15 +306,38 @@ class Component(object):
         # Internal dictonary to hold the sub components of the component.
         self._components = OrderedDict()
 
-        # Internal attribute to collect html of refreshed.
-        self._html = None
+        # Internal index of all components of the sub tree by id. Only kept
+        # up to date by root components.
+        self._index = {}
+
+        # Internal attribute to collect the refreshed components of the tree.
+        # Only used by root components.
+        self._dirty = None
+
+        # Internal attribute to collect HTML which should be appended to
+        # components. Only used by root components.
+        self._appends = None
 
         # Internal attribute to collect messages which should be displayed to
         # the user.
         self._messages = []
 
+        # Internal attribute to collect changed reactive attributes of the
+        # tree. Only used by root components.
+        self._updates = None
+
+        if lazy is not None:
+            self.lazy = lazy
+
+        # True as long as the deferred init_components of a lazy component
+        # hasn't been run.
+        self._pending = False
+
         if initial_components:
             self.initial_components = initial_components
+        elif self.lazy:
+            self._pending = True
+            return
         else:
             self.init_components()
 
@@ -142,10 +350,53 @@ class Component(object):
 
         component
             The component which should be added.
+
+        Raises ``ValueError`` if a component with the same id exists already
+        within the component tree.
         """
+        if self._components.get(component.id) is component:
+            return
+
+        root = self.get_root()
+        index = component._index
+        if index is None:
+            index = component._build_index()
+
+        for id in [component.id] + list(index):
+            if id in root._index or id == root.id:
+                raise ValueError("Component with id {} exists already".format(id))
+
+        self.touch()
         component.parent = self
         self._components[component.id] = component
 
+        root._index[component.id] = component
+        root._index.update(index)
+        component._index = None
+
+        if component._dirty:
+            if root._dirty is None:
+                root._dirty = OrderedDict()
+            root._dirty.update(component._dirty)
+            component._dirty = None
+
+    def append_html(self, html, selector=None):
+        """Appends HTML to the component once the current request is returned
+        to the browser. Other than ``refresh`` the component is not
+        rerendered.
+
+        html
+            The HTML which should be appended.
+
+        selector
+            An optional CSS selector of the element the HTML is appended to.
+            Defaults to the element with the id of the component.
+        """
+        root = self.get_root()
+        if root._appends is None:
+            root._appends = []
+        root._appends.append((self, selector or "#{}".format(self.id), html))
+
     def add_message(self, message, type="info"):
         """Adds a message.
 
@@ -173,6 +424,7 @@ class Component(object):
         """Returns all direct child components of the current component as a
         list.
         """
+        self.ensure_components()
         return self._components.values()
 
     @classmethod
@@ -180,6 +432,15 @@ class Component(object):
         request = cls.get_request()
         del request.session["cba"]
 
+    def ensure_components(self):
+        """Runs the deferred ``init_components`` of a lazy component.
+        """
+        if self._pending:
+            self._pending = False
+            self.init_components()
+            self._add_components()
+            self.after_initial_components()
+
     def get_component(self, id, direct_only=False, with_root=True):
         """Returns the component with the passed id.
 
@@ -197,18 +458,29 @@ class Component(object):
         with_root
             If true a second search is started with root as base.
         """
+        self.ensure_components()
         component = self._components.get(id)
-        if component:
+        if component is not None:
             return component
-        elif direct_only is False:
-            for component in self.components:
-                temp = component.get_component(id, direct_only, with_root)
-                if temp:
-                    return temp
 
-        # In case nothing has been found we try the parents also.
-        if with_root:
-            return self.get_root().get_component(id, with_root=False)
+        if direct_only and not with_root:
+            return None
+
+        # Pending lazy components are not initialized by misses, as their ids
+        # are unknown. They are initialized by lookups through themselves.
+        root = self.get_root()
+        component = root._index.get(id)
+        if component is None or with_root:
+            return component
+
+        # Only components of the sub tree are taken into account.
+        parent = component.parent
+        while parent is not None:
+            if parent is self:
+                return component
+            parent = parent.parent
+
+        return None
 
     def get_root(self):
         """Returns the root component.
@@ -240,6 +512,18 @@ class Component(object):
         """
         pass
 
+    def is_hidden(self):
+        """Returns True if the component is hidden within the browser. Lazy
+        components which are hidden are rendered as placeholder.
+        """
+        return not self.displayed
+
+    def is_placeholder(self):
+        """Returns True if the component is rendered as placeholder, i.e. it
+        is lazy, not initialized yet and hidden.
+        """
+        return self._pending and self.is_hidden()
+
     def is_root(self):
         """Returns True if the component is the root component.
         """
@@ -252,15 +536,19 @@ class Component(object):
         """Rerenders the current component once the current request is returned
         to the browser.
         """
-        self._html = ["#{}".format(self.id), self.render()]
+        root = self.get_root()
+        if root._dirty is None:
+            root._dirty = OrderedDict()
+        root._dirty[self.id] = self
 
     def refresh_all(self):
         """Refresh the component and reloads the initial sub components.
         """
-        self._components.clear()
+        self._pending = False
+        self._remove_components()
         self.init_components()
         self._add_components()
-        self._html = ["#{}".format(self.id), self.render()]
+        self.refresh()
 
     def remove_component(self, id):
         """Removes a component from sub components of the current component.
@@ -269,12 +557,21 @@ class Component(object):
         id
             The id of the component which should be removed.
         """
-        try:
-            del self._components[id]
-        except KeyError:
+        component = self._components.get(id)
+        if component is None:
             return False
-        else:
-            return True
+
+        self.touch()
+        del self._components[id]
+
+        index = component._build_index()
+        root_index = self.get_root()._index
+        root_index.pop(id, None)
+        for key in index:
+            root_index.pop(key, None)
+        component._index = index
+
+        return True
 
     def replace_component(self, id, component):
         """Replaces a component with another.
@@ -293,16 +590,150 @@ class Component(object):
     def render(self):
         """Renders the current component as HTML.
         """
-        if self.template:
-            if self.remove_after_render:
-                del self.parent._components[self.id]
-
-            return render_to_string(self.template, {
+        if self.is_placeholder():
+            return render_template(self.placeholder_template, {
                 "self": self,
             })
+
+        if self.template:
+            if self.remove_after_render:
+                self.parent.remove_component(self.id)
+
+            if not self.render_cache:
+                return render_template(self.template, {
+                    "self": self,
+                })
+
+            cache = get_render_cache()
+            key = get_fingerprint(self)
+            html = cache.get(key)
+            if html is None:
+                html = render_template(self.template, {
+                    "self": self,
+                })
+                cache.set(key, html)
+            return html
         else:
             return ""
 
+    def run_in_background(self, func, callback, args=(), kwargs=None, errback=None):
+        """Runs ``func`` within a background thread (see ``cba.push``). Once
+        it has been finished, its result is pushed to the tab of the current
+        event: the method ``callback`` of the component is called with the
+        result within a request of its own, hence the component can change
+        and refresh itself as within an event handler, e.g.::
+
+            @event_handler
+            def handle_report(self):
+                self.run_in_background(create_report, "show_report", args=(self.year,))
+
+            def show_report(self, report):
+                self.report = report
+                self.refresh()
+
+        func
+            The callable which does the work. It must not access the
+            components, as they are not locked.
+
+        callback
+            The name of the method which is called with the result.
+
+        args, kwargs
+            The arguments of ``func``.
+
+        errback
+            The name of the method which is called with the exception if
+            ``func`` fails. Defaults to ``None``, which means the failure is
+            only logged.
+        """
+        request = self.get_request()
+        tab = getattr(request, "_cba_tab", None)
+        if tab is None:
+            raise RuntimeError("Background work can only be started within an event")
+
+        mailbox = Mailbox(tab)
+        mailbox.submit()
+        request._cba_push = True
+        get_pool().apply_async(run_work, (
+            mailbox, self.id, callback, errback, func, args, kwargs or {}))
+
+    def touch(self):
+        """Announces that the component is about to be changed in place.
+
+        Changes made by assigning attributes are recorded automatically for
+        the history. Changes of mutable attribute values in place (e.g.
+        ``self.attributes["style"] = "color:red"``) are not, hence ``touch``
+        must be called before, unless an attribute of the component has been
+        assigned within the current event already.
+
+        The former state keeps shallow copies of dictionaries, lists, sets and
+        of objects which define ``__copy__``. All other attribute values are
+        shared between the states, hence they must be replaced instead of
+        changed in place.
+        """
+        journal = get_journal()
+        if journal is not None:
+            journal.touch(self)
+
+    def _update(self, name, value):
+        """Records the change of a reactive attribute for the browser.
+        """
+        try:
+            old = self.__dict__[name]
+        except KeyError:
+            # The attribute is initialized.
+            return
+        if old == value:
+            return
+
+        # The placeholder of a lazy component is replaced once it is shown.
+        if name == "displayed" and value and self._pending:
+            self.refresh()
+
+        root = self.get_root()
+        if root._updates is None:
+            root._updates = OrderedDict()
+        component, changes = root._updates.setdefault(self.id, (self, {}))
+        changes.setdefault(name, [old, value])[1] = value
+
+    def _build_index(self):
+        """Returns all components of the sub tree by id.
+        """
+        index = {}
+        stack = list(self._components.values())
+        while stack:
+            component = stack.pop()
+            index[component.id] = component
+            stack.extend(component._components.values())
+        return index
+
+    def _reindex(self):
+        """Rebuilds the index of a root component.
+        """
+        self._index = self._build_index()
+
+    def _remove_components(self):
+        """Removes all sub components.
+        """
+        for id in list(self._components):
+            self.remove_component(id)
+
+    def _get_state(self):
+        """Returns a copy of the attributes of the component.
+        """
+        return copy_state(self.__dict__)
+
+    def _swap_state(self, state):
+        """Replaces the attributes of the component with the passed ones and
+        returns the former attributes.
+        """
+        current = self.__dict__
+        for name in UNTRACKED:
+            if name in current:
+                state[name] = current.pop(name)
+        object.__setattr__(self, "__dict__", state)
+        return current
+
     def _add_components(self):
         """Adds initial components into the default components structure.
         """
@@ -321,12 +752,66 @@ class CBAView(View):
     """The default base class.
 
     All views of an cba application should be inherit from this class.
+
+        history_max_depth
+            The maximal amount of history states which are kept. Defaults to
+            50.
+
+        history_max_bytes
+            The maximal size of the history deltas in bytes. Defaults to 1 MB.
+
+        tree_store
+            The store of the histories. Defaults to ``None``, which means
+            the store of the setting ``CBA_TREE_STORE``.
+
+        websocket_url
+            The path of the WebSocket consumer of the view, see
+            ``cba.websocket``. If given the browser sends the events through
+            the WebSocket instead of ajax requests. Defaults to ``None``.
+
+        push_timeout
+            The maximal amount of seconds a poll request of the browser waits
+            for results of background work. The request occupies a worker
+            thread of the server meanwhile. Defaults to the setting
+            ``CBA_PUSH_TIMEOUT`` or 10.
+
+        patch_responses
+            If True refreshed components are sent as patches against the
+            HTML which has been sent to the browser last, see ``cba.patch``.
+            Defaults to ``True``.
+
+        patch_max_bytes
+            The maximal size of the HTML which is kept per tab for patches.
+            Defaults to 512 KB.
+
+        compact_responses
+            If True the refreshed components are sent as flat lists of ids
+            and HTML (``h``) and of ids and patches (``p``) instead of
+            ``html`` and ``patches``. Defaults to ``False``.
+
+        compress_min_bytes
+            Responses of at least this size are compressed with brotli (if
+            installed) or gzip. ``None`` turns compression off. Defaults to
+            1024.
     """
     template = "cba/main.html"
+    history_max_depth = 50
+    history_max_bytes = 1024 * 1024
+    tree_store = None
+    websocket_url = None
+    push_timeout = None
+    patch_responses = True
+    patch_max_bytes = 512 * 1024
+    compact_responses = False
+    compress_min_bytes = 1024
 
     def __init__(self, **kwargs):
         super(CBAView, self).__init__(**kwargs)
+        self._history = None
         self._html = []
+        self._patches = []
+        self._updates = []
+        self._append = []
         self._messages = []
 
     def get(self, *args, **kwargs):
@@ -342,128 +827,424 @@ class CBAView(View):
         self.root = self.root(id="root")
         content = self.root.render()
 
-        if "root" not in self.request.session:
-            self.request.session["root"] = {}
-
-        # Create the first history state
-        self.request.session["root"]["0"] = self.root
-        self.request.session.modified = True
+        # Create the history with the first state
+        history = History(
+            self.root,
+            max_depth=self.history_max_depth,
+            max_bytes=self.history_max_bytes,
+        )
+        tab = HistoryStore(self.request, store=self.tree_store).create(history)
 
         return render(self.request, self.template, {
             "content": content,
+            "tab": tab,
+            "websocket_url": self.websocket_url,
         })
 
     def post(self, *args, **kwargs):
         """Handles all subsequent ajax calls.
         """
+        action = self.request.POST.get("action")
+        if action == "poll":
+            return self._poll()
+
+        store = HistoryStore(self.request, store=self.tree_store)
+        history = store.load(self.request.POST.get("tab"))
+
+        # The history has been expired, the page has to be requested again.
+        if history is None:
+            return self._json_response({"reload": True})
+
+        # Background work, which is started by the event, pushes its results
+        # to this tab (see Component.run_in_background).
+        self.request._cba_tab = store.tab
+
+        # The browser numbers the requests of a tab and sends them one after
+        # another. Requests which are not newer than the last handled one are
+        # duplicates or have been overtaken; they are dropped.
+        sequence = self.request.POST.get("sequence")
+        if sequence is not None:
+            sequence = int(sequence)
+            if sequence <= history.sequence:
+                logger.debug("Request {} is outdated ({})".format(sequence, history.sequence))
+                return self._json_response({"outdated": True})
+            history.sequence = sequence
+
+        response = {}
+        version = history.version
+        self._history = history
 
         # Reload a state then popstate event has been triggerd (back/foward
         # button)
-        if self.request.POST.get("action") == "reload":
-            state = str(self.request.POST.get("state"))
-            self.root = self.request.session["root"][state]
-            self.root.refresh()
-            self._collect_components_data(self.root)
+        if action == "reload":
+            # The browser couldn't apply a patch, hence everything is sent
+            # completely.
+            if self.request.POST.get("full") == "true" and getattr(history, "sent", None):
+                history.sent.clear()
+
+            state = int(self.request.POST.get("state"))
+            if state not in history:
+                # The state has been evicted, we stay with the current one.
+                logger.debug("History state {} not found".format(state))
+                state = response["state"] = history.state
+            self._reload(history, state)
+        elif action == "push":
+            self._push(history, Mailbox(store.tab))
         else:
             # Creates a new history state
             create_state = self.request.POST.get("create_state")
             create_state = True if create_state == "true" else False
-            new_state = str(self.request.POST.get("state"))
-            state = str(int(new_state) - 1)
-            self.root = copy.deepcopy(self.request.session["root"][state])
-
-            self._clear_components_data(self.root)
-            self._load_data(self.root)
-
-            # component_id is always the event triggering component. For DnD this
-            # means component_id is the droppable and source_id is the dragged
-            # item. For non DnD events source_id is None.
-            handler = self.request.POST.get("handler")
-            element_id = self.request.POST.get("element_id")
-            component_id = self.request.POST.get("component_id")
-            component_value = self.request.POST.get("component_value")
-            source_id = self.request.POST.get("source_id")
-            key_code = self.request.POST.get("key_code")
-
-            component = self.root.get_component(component_id)
-
-            logger.debug("Handler: {} / Component: {}".format(handler, component))
-
-            # Bubbles up the components to find the handler
-            handler_found = False
-            while component:
-                if hasattr(component, handler):
-                    component.element_id = element_id
-                    component.component_id = component_id
-                    component.component_value = component_value
-                    component.source_id = source_id
-                    component.key_code = key_code
-                    getattr(component, handler)()
-                    handler_found = True
-                    break
-                component = component.parent
-
-            if handler_found is False:
-                logger.error("Handler {} not found".format(handler))
-                raise AttributeError("Handler {} not found".format(handler))
+            state = int(self.request.POST.get("state")) - 1
+
+            if state not in history:
+                # The event has been triggered within an evicted state. It is
+                # dropped and the current state is displayed instead.
+                logger.debug("History state {} not found".format(state))
+                response["state"] = history.state
+                self._reload(history, history.state)
+            else:
+                # Only the components which are changed by the event are
+                # copied, see cba.history.
+                self.root = history.checkout(state)
+                self._clear_components_data(self.root)
+
+                with Journal() as journal:
+                    if self.request.POST.get("partial") == "true":
+                        self._load_changed_data(self.root)
+                    else:
+                        self._load_data(self.root)
+                    self._forget_browser_values(self.root)
+                    # The browser knows the values it has sent.
+                    self.root._updates = None
+                    for event in self._get_events():
+                        self._handle_event(event)
+                    self._collect_components_data(self.root)
+
+                logger.debug("Refreshed components: {}".format(self._html))
+                logger.debug("Collected messages: {}".format(self._messages))
+
+                history.commit(journal, state, create_state)
+
+        # The HTML which has been sent is stored with the history.
+        if self.patch_responses and (self._html or self._patches or self._updates or self._append):
+            history.version += 1
+
+        # The history is only stored again if it has been changed. If another
+        # request of the tab has stored it meanwhile, the changes are dropped
+        # rather than overwriting the ones of the other request.
+        if history.version != version and not store.save(history):
+            logger.debug("Request {} lost against a concurrent request".format(sequence))
+            return self._json_response({"outdated": True})
+
+        if self.compact_responses:
+            response["h"] = [value for id, html in self._html for value in (id[1:], html)]
+            if self._patches:
+                response["p"] = [value for id, ops in self._patches for value in (id[1:], ops)]
+        else:
+            response["html"] = self._html
+            if self._patches:
+                response["patches"] = self._patches
+        if self._updates:
+            response["updates"] = self._updates
+        response["messages"] = self._messages
+        if self._append:
+            response["append"] = self._append
+        if getattr(self.request, "_cba_push", False):
+            response["push"] = True
+        return self._json_response(response)
+
+    def _poll(self):
+        """Waits for results of background work of the tab at most
+        ``push_timeout`` seconds (long polling). The results are taken by a
+        subsequent push request.
+        """
+        tabs = self.request.session.get(HistoryStore.session_key, [])
+        tab = self.request.POST.get("tab")
+        if tab not in tabs:
+            return self._json_response({"ready": False, "pending": 0})
+
+        timeout = self.push_timeout
+        if timeout is None:
+            timeout = getattr(settings, "CBA_PUSH_TIMEOUT", 10)
+
+        mailbox = Mailbox(tab)
+        ready = mailbox.wait(timeout)
+        return self._json_response({"ready": ready, "pending": mailbox.pending})
+
+    def _push(self, history, mailbox):
+        """Passes the results of background work to the callbacks of their
+        components. The changes are applied to the current state.
+        """
+        self.root = history.checkout(history.state)
+        self._clear_components_data(self.root)
 
+        with Journal() as journal:
+            for component_id, callback, result in mailbox.take():
+                if component_id == self.root.id:
+                    component = self.root
+                else:
+                    component = self.root.get_component(component_id)
+                if component is None or callback is None:
+                    # The component has been removed meanwhile or the work
+                    # has failed without errback.
+                    continue
+                getattr(component, callback)(result)
             self._collect_components_data(self.root)
-            logger.debug("Refreshed components: {}".format(self._html))
-            logger.debug("Collected messages: {}".format(self._messages))
 
-            if create_state:
-                self.request.session["root"][new_state] = self.root
-            else:
-                self.request.session["root"][state] = self.root
-
-            self.request.session.modified = True
-
-        return HttpResponse(
-            json.dumps(
-                {
-                    "html": self._html,
-                    "messages": self._messages,
-                },
-                cls=LazyEncoder
-            ),
-            content_type='application/json'
-        )
+        history.commit(journal, history.state)
+
+        # Further results are announced by the push flag.
+        if mailbox.pending:
+            self.request._cba_push = True
+
+    def _reload(self, history, state):
+        """Makes the passed state the current one and rerenders it.
+        """
+        self.root = history.checkout(state)
+        self._clear_components_data(self.root)
+        with Journal() as journal:
+            self.root.refresh()
+            self._collect_components_data(self.root)
+        history.commit(journal, state)
+
+    def _json_response(self, data):
+        content = dumps(data)
+        encoding = None
+        if self.compress_min_bytes is not None and len(content) >= self.compress_min_bytes:
+            content, encoding = compress(content, self.request.META.get("HTTP_ACCEPT_ENCODING", ""))
+
+        response = HttpResponse(content, content_type='application/json')
+        if encoding is not None:
+            response["Content-Encoding"] = encoding
+        if self.compress_min_bytes is not None:
+            patch_vary_headers(response, ("Accept-Encoding",))
+        return response
+
+    def _get_events(self):
+        """Returns the events of the request. The browser sends several
+        events at once as JSON list with the key ``events``, a single event
+        with the keys ``handler``, ``component_id``, etc.
+        """
+        events = self.request.POST.get("events")
+        if events is None:
+            return [self.request.POST]
+
+        # The values are strings, as if they had been sent as single event.
+        return [
+            dict((name, value if value is None else six.text_type(value)) for name, value in event.items())
+            for event in json.loads(events)
+        ]
+
+    def _handle_event(self, event):
+        """Calls the handler of the event triggering component.
+        """
+        # component_id is always the event triggering component. For DnD this
+        # means component_id is the droppable and source_id is the dragged
+        # item. For non DnD events source_id is None.
+        handler = event.get("handler")
+        element_id = event.get("element_id")
+        component_id = event.get("component_id")
+        component_value = event.get("component_value")
+        source_id = event.get("source_id")
+        key_code = event.get("key_code")
+
+        component = self.root.get_component(component_id)
+
+        logger.debug("Handler: {} / Component: {}".format(handler, component))
+
+        # Bubbles up the components to find the handler. Only registered
+        # handlers are called (see event_handler).
+        while component:
+            method = get_event_handlers(type(component)).get(handler)
+            if method is not None:
+                component.ensure_components()
+                component.element_id = element_id
+                component.component_id = component_id
+                component.component_value = component_value
+                component.source_id = source_id
+                component.key_code = key_code
+                method(component)
+                return
+            component = component.parent
+
+        logger.error("Handler {} not found".format(handler))
+        raise AttributeError("Handler {} not found".format(handler))
 
     def _clear_components_data(self, root):
-        """Clears messsage and html of all components.
+        """Clears messsages and refreshed components of the tree.
         """
-        root._html = []
+        root._dirty = None
+        root._appends = None
+        root._updates = None
         root._messages = []
-        if hasattr(root, "components"):
-            for component in root.components:
-                component._html = ""
-                component._messages = []
-                self._clear_components_data(component)
 
-    def _collect_components_data(self, component):
-        """Collects refreshed HTML and messages from all components.
-        """
-        if component.is_root():
-            if component._html:
-                self._html.append(component._html)
+    def _collect_components_data(self, root):
+        """Renders the refreshed components and collects appended HTML and
+        messages of the tree.
 
-            if component._messages:
-                self._messages.extend(component._messages)
+        Components which are not part of the tree anymore or whose ancestors
+        are refreshed as well are skipped.
+        """
+        dirty = root._dirty or {}
+        appends = root._appends or []
+        updates = root._updates or {}
+        root._dirty = None
+        root._appends = None
+        root._updates = None
+
+        # Cached bodies which contain changed components are outdated: the
+        # components which have been changed within the event (including the
+        # values from the browser), refreshed or updated. The bodies within
+        # refreshed components are rendered again as well.
+        changed = list(dirty.values())
+        changed.extend(component for component, selector, html in appends)
+        changed.extend(component for component, changes in updates.values())
+
+        journal = get_journal()
+        records = list(journal.records) if journal is not None else []
+        for component, state in records:
+            changed.append(component)
+            # The body of a component consists of its sub components and
+            # depends on its own attributes, except of its activation.
+            former = [id(c) for c in state.get("_components", {}).values()]
+            if former != [id(c) for c in component._components.values()] or self._is_body_changed(component, state):
+                self._renew_body_keys(component)
+
+        for component in changed:
+            self._renew_body_keys(component.parent)
+        for component in dirty.values():
+            self._renew_body_keys(component, descendants=True)
+
+        for component in list(dirty.values()):
+            if self._is_attached(root, component) and not self._is_refreshed(component.parent, dirty):
+                self._add_html(component, component.render())
+
+        for component, selector, html in appends:
+            if self._is_attached(root, component) and not self._is_refreshed(component, dirty):
+                self._append.append([selector, html])
+                self._forget_html(component)
+
+        # Changed reactive attributes of components, which are not rendered.
+        # The browser needs the former css class to remove it.
+        for component, changes in updates.values():
+            if self._is_attached(root, component) and not self._is_refreshed(component, dirty):
+                values = dict(
+                    (name, [old, value] if name == "css_class" else value)
+                    for name, (old, value) in changes.items() if old != value
+                )
+                if values:
+                    self._updates.append([component.id, values])
+                    self._forget_html(component)
+
+        self._messages.extend(root._messages)
+
+    def _add_html(self, component, html):
+        """Adds the HTML of a refreshed component to the response. If the
+        HTML which has been sent last is known, only a patch is sent (see
+        ``cba.patch``), unless the HTML is smaller.
+        """
+        selector = "#{}".format(component.id)
+        sent = self._get_sent_html()
+        if sent is None:
+            self._html.append([selector, html])
+            return
+
+        old = sent.get(component.id)
+        if old is None:
+            ops = None
+        elif old == html:
+            ops = []
+        else:
+            ops = get_patch(old, html)
+
+        if ops is None:
+            self._html.append([selector, html])
+        elif ops:
+            self._patches.append([selector, ops])
+
+        # The HTML of the ancestors and of the sub components, which has been
+        # sent before, is outdated now.
+        self._forget_html(component)
+        for id in get_ids(html):
+            sent.discard(id)
+        sent.set(component.id, html)
+
+    def _forget_html(self, component):
+        """Forgets the sent HTML of the component and its ancestors.
+        """
+        sent = self._get_sent_html()
+        while sent is not None and component is not None:
+            sent.discard(component.id)
+            component = component.parent
+
+    def _forget_browser_values(self, root):
+        """Forgets the sent HTML of the components whose values have been
+        sent by the browser, as the values within the browser differ from the
+        sent ones.
+        """
+        for key in itertools.chain(self.request.POST, self.request.FILES):
+            id = key[:-2] if key.endswith("[]") else key
+            component = root._index.get(id)
+            if component is not None:
+                self._forget_html(component)
+
+    def _get_sent_html(self):
+        if not self.patch_responses or self._history is None:
+            return None
+        if getattr(self._history, "sent", None) is None:
+            self._history.sent = SentHTML(self.patch_max_bytes)
+        return self._history.sent
 
-        if hasattr(component, "components"):
-            for component in component.components:
-                if component._html:
-                    self._html.append(component._html)
-                if component._messages:
-                    self._messages.extend(component._messages)
-                self._collect_components_data(component)
+    def _is_body_changed(self, component, state):
+        """Returns True if an attribute of the component with a body key,
+        which is part of its body, differs from the passed former state.
+        """
+        if getattr(component, "body_key", None) is None:
+            return False
+        current = component.__dict__
+        names = (set(state) | set(current)) - NOT_BODY
+        return any(state.get(name) != current.get(name) for name in names)
+
+    def _renew_body_keys(self, component, descendants=False):
+        """Renews the body keys of the component and its ancestors or, with
+        ``descendants``, of its initialized sub components. Components with a
+        ``body_key`` cache their rendered body by this key, e.g. lazy tab
+        items.
+        """
+        if descendants:
+            stack = list(component._components.values())
+            while stack:
+                descendant = stack.pop()
+                if getattr(descendant, "body_key", None) is not None:
+                    descendant.body_key = uuid.uuid4().hex
+                stack.extend(descendant._components.values())
+            return
+
+        while component is not None:
+            if getattr(component, "body_key", None) is not None:
+                component.body_key = uuid.uuid4().hex
+            component = component.parent
+
+    def _is_attached(self, root, component):
+        return component is root or root._index.get(component.id) is component
+
+    def _is_refreshed(self, component, dirty):
+        """Returns True if the component or one of its ancestors is within
+        the refreshed components.
+        """
+        while component is not None:
+            if dirty.get(component.id) is component:
+                return True
+            component = component.parent
+        return False
 
     def _load_data(self, root):
         """Loads components with values from the browser.
         """
         logger.debug("load data for {}".format(root))
         if hasattr(root, "components"):
-            for component in root.components:
+            # Lazy components which are pending have no inputs yet.
+            for component in list(root._components.values()):
                 if component.id in self.request.POST:
                     root._components[component.id].value = self.request.POST.get(component.id)
                 else:
@@ -489,3 +1270,36 @@ class CBAView(View):
                     root._components[component.id].to_delete = self.request.POST.getlist("delete-{}[]".format(component.id))
 
                 self._load_data(component)
+
+    def _load_changed_data(self, root):
+        """Loads components with values from the browser, when only the changed
+        inputs have been sent. The components are looked up by id.
+        """
+        for key in self.request.POST:
+            if key.endswith("[]"):
+                id = key[:-2]
+                value = self.request.POST.getlist(key)
+            else:
+                id = key
+                value = self.request.POST.get(key)
+
+            # The FileInput component sends ids of images which should be
+            # delete. Per convention these are send with the key
+            # "delete"-<component.id>.
+            if id.startswith("delete-") and key.endswith("[]"):
+                component = root._index.get(id[len("delete-"):])
+                if component is not None:
+                    component.to_delete = value
+                continue
+
+            component = root._index.get(id)
+            if component is not None:
+                component.value = value
+
+        for id in self.request.FILES:
+            component = root._index.get(id)
+            if component is not None:
+                if component.multiple:
+                    component.value = self.request.FILES.getlist(id)
+                else:
+                    component.value = self.request.FILES.get(id)
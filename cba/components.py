@@ -1,5 +1,19 @@
 import sys
+import time
+import uuid
+from collections import OrderedDict
+from threading import Lock
+
+from django.db.models import Q
+from django.utils import six
+from django.utils.encoding import force_text
+
+from cba import get_request
+
 from . base import Component
+from . base import event_handler
+from . rendering import get_render_cache
+from . rendering import render_template
 
 
 class Button(Component):
@@ -151,7 +165,7 @@ class Group(Component):
     def clear(self):
         """Deletes all sub components.
         """
-        self._components.clear()
+        self._remove_components()
 
 
 class HiddenInput(Component):
@@ -370,22 +384,361 @@ class Select(Component):
         self.value = None
 
 
+class _ResultCache(object):
+    """The cached results of the data providers in process. The least
+    recently used results are evicted if there are more than ``max_entries``.
+
+    The results are kept outside of the providers, hence they are not pickled
+    with the history but are available for all requests of the process.
+    """
+    def __init__(self, max_entries=100):
+        self.max_entries = max_entries
+        self._results = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            result = self._results.pop(key, default)
+            if result is not default:
+                self._results[key] = result
+        return result
+
+    def set(self, key, result):
+        with self._lock:
+            self._results.pop(key, None)
+            self._results[key] = result
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+
+
+_results = _ResultCache()
+
+
 class TableDataProvider(object):
+    """Provides the rows of a table from the list ``data``.
+
+    The rows can be ordered by a column and filtered. The order of a column is
+    computed only once and the results are cached per order and filters,
+    until ``data`` is replaced or ``invalidate`` is called. The results are
+    cached in process by a key of ``data``, which is renewed by both.
+    """
+    # Maximal amount of cached results.
+    max_results = 10
+
     def __init__(self):
         self.data = []
 
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+        self.invalidate()
+
     def get_headers(self):
         return None
 
-    def get_rows(self, start, end):
-        return self.data[start:end]
+    def get_rows(self, start, end, order_by=None, reverse=False, filters=None):
+        """Returns the rows from start to end.
 
-    def total_rows(self):
-        return len(self.data)
+        order_by
+            The index of the column the rows are ordered by.
+
+        reverse
+            If True the rows are ordered descending.
+
+        filters
+            A dictionary with column indexes and values. Only rows which
+            columns contain the values (case-insensitive) are returned.
+        """
+        return self._get_result(order_by, reverse, filters)[start:end]
+
+    def get_row(self, id):
+        """Returns the row with the passed id or ``None``.
+        """
+        for row in self.data:
+            if row.get("id") == id:
+                return row
+        return None
+
+    def total_rows(self, filters=None):
+        return len(self._get_result(None, False, filters))
 
     def get_column_definitions(self):
         return None
 
+    def invalidate(self):
+        """Renews the key of the cached orders and results. Must be called if
+        ``data`` is changed in place.
+        """
+        self._data_key = uuid.uuid4().hex
+
+    def __copy__(self):
+        """Returns a copy for a former history state, which shares ``data``
+        and its cached results.
+        """
+        result = self.__class__.__new__(self.__class__)
+        result.__dict__.update(self.__dict__)
+        return result
+
+    def _get_cache(self):
+        """Returns the cached orders (by column) and results (by order and
+        filters) of ``data``.
+        """
+        cache = _results.get(self._data_key)
+        if cache is None:
+            cache = ({}, OrderedDict())
+            _results.set(self._data_key, cache)
+        return cache
+
+    def _get_result(self, order_by, reverse, filters):
+        if order_by is None and not filters:
+            return self.data
+
+        orders, results = self._get_cache()
+        key = (order_by, reverse, _get_filters_key(filters))
+        result = results.pop(key, None)
+
+        if result is None:
+            result = self.data
+            if order_by is not None:
+                result = orders.get(order_by)
+                if result is None:
+                    result = sorted(self.data, key=lambda row: row["data"][order_by])
+                    orders[order_by] = result
+                if reverse:
+                    result = result[::-1]
+
+            if filters:
+                filters = [(column, force_text(value).lower()) for column, value in filters.items()]
+                result = [
+                    row for row in result
+                    if all(value in force_text(row["data"][column]).lower() for column, value in filters)
+                ]
+
+        results[key] = result
+        while len(results) > self.max_results:
+            results.popitem(last=False)
+
+        return result
+
+
+class QuerySetDataProvider(TableDataProvider):
+    """A data provider for a Django QuerySet.
+
+    Only the id and the given columns are selected. Subsequent pages are
+    requested by keyset pagination (seek), i.e. by filtering for rows after
+    the last row of the former page instead of using an offset. The amount of
+    rows is cached. Ordering and filtering is done by the database.
+
+        queryset
+            The QuerySet which provides the rows. If it is not ordered, it is
+            ordered by primary key. The primary key is added to the ordering
+            in any case to make it unique.
+
+        columns
+            The names of the fields which are displayed.
+
+        headers
+            The headers of the table. Defaults to the verbose names of the
+            fields.
+
+        id_prefix
+            The prefix of the row ids, which are built with the primary key.
+            Defaults to the model name.
+
+        count_timeout
+            The amount of seconds the amount of rows is cached. If ``None``
+            the amount is cached for the current request.
+
+        page_timeout
+            The amount of seconds the rows of a page are cached per order,
+            filters and range. If ``None`` the rows are cached for the current
+            request.
+
+    Cached amounts and pages are kept in process, not within the history.
+    """
+    # Maximal amount of remembered keys for keyset pagination.
+    max_keys = 100
+
+    def __init__(self, queryset, columns, headers=None, id_prefix=None, count_timeout=None,
+                 page_timeout=None):
+        ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+        if not any(field in ("pk", "-pk", queryset.model._meta.pk.name) for field in ordering):
+            ordering.append("pk")
+
+        self.queryset = queryset.order_by(*ordering)
+        self.ordering = ordering
+        self.columns = columns
+        self.headers = headers
+        self.id_prefix = id_prefix or queryset.model._meta.model_name
+        self.count_timeout = count_timeout
+        self.page_timeout = page_timeout
+
+        # Keyset pagination is only possible with plain field names.
+        self._keyset = all(isinstance(field, six.string_types) for field in ordering)
+        self.invalidate()
+
+    def invalidate(self):
+        """Clears the remembered keys and renews the key of the cached amounts
+        and pages. Should be called if rows have been changed, unless the
+        timeouts are short enough.
+        """
+        self._data_key = uuid.uuid4().hex
+        self._keys = OrderedDict()
+
+    def __getstate__(self):
+        """The provider is pickled with the history. Pickling a QuerySet would
+        evaluate it, hence only its model and query are kept.
+        """
+        state = self.__dict__.copy()
+        state["queryset"] = (self.queryset.model, self.queryset.query)
+        return state
+
+    def __setstate__(self, state):
+        model, query = state["queryset"]
+        state["queryset"] = model._default_manager.all()
+        state["queryset"].query = query
+        self.__dict__.update(state)
+
+    def get_headers(self):
+        if self.headers is not None:
+            return self.headers
+        meta = self.queryset.model._meta
+        return [meta.get_field(column).verbose_name for column in self.columns]
+
+    def get_rows(self, start, end, order_by=None, reverse=False, filters=None):
+        query = (order_by, reverse, _get_filters_key(filters))
+        return self._get_cached(
+            ("rows",) + query + (start, end), self.page_timeout,
+            lambda: self._query_rows(start, end, query, order_by, reverse, filters))
+
+    def get_row(self, id):
+        prefix = "{}-".format(self.id_prefix)
+        if not isinstance(id, six.string_types) or not id.startswith(prefix):
+            return None
+
+        try:
+            values = self.queryset.filter(pk=id[len(prefix):]).values_list(*self._get_fields(self.ordering))[0]
+        except (IndexError, ValueError):
+            return None
+
+        return self._create_row(values)
+
+    def total_rows(self, filters=None):
+        return self._get_cached(
+            ("count", _get_filters_key(filters)), self.count_timeout,
+            lambda: self._get_queryset(None, False, filters)[0].count())
+
+    def _get_cached(self, key, timeout, function):
+        """Returns the cached result of ``function`` for the passed key. If
+        ``timeout`` is ``None`` the result is cached for the current request,
+        otherwise in process for ``timeout`` seconds.
+        """
+        if timeout is None:
+            request = get_request()
+            results = getattr(request, "_cba_results", None)
+            if results is None:
+                results = {}
+                if request is not None:
+                    request._cba_results = results
+            key = (id(self),) + key
+            if key not in results:
+                results[key] = function()
+            return results[key]
+
+        key = (self._data_key,) + key
+        result, cached = _results.get(key, (None, None))
+        if cached is None or time.time() - cached > timeout:
+            result = function()
+            _results.set(key, (result, time.time()))
+        return result
+
+    def _create_row(self, values):
+        return {
+            "id": "{}-{}".format(self.id_prefix, values[0]),
+            "data": list(values[1:len(self.columns) + 1]),
+        }
+
+    def _get_fields(self, ordering):
+        fields = ["pk"] + list(self.columns)
+        if self._keyset:
+            fields.extend(field.lstrip("-") for field in ordering)
+        return fields
+
+    def _get_queryset(self, order_by, reverse, filters):
+        """Returns the ordered and filtered queryset and its ordering.
+        """
+        queryset = self.queryset
+        ordering = self.ordering
+
+        if filters:
+            queryset = queryset.filter(**dict(
+                ("{}__icontains".format(self.columns[column]), value)
+                for column, value in filters.items()
+            ))
+
+        if order_by is not None:
+            field = self.columns[order_by]
+            ordering = ["-" + field if reverse else field] + [
+                former for former in ordering
+                if not isinstance(former, six.string_types) or former.lstrip("-") != field
+            ]
+            queryset = queryset.order_by(*ordering)
+
+        return queryset, ordering
+
+    def _query_rows(self, start, end, query, order_by, reverse, filters):
+        queryset, ordering = self._get_queryset(order_by, reverse, filters)
+        key = self._keys.get(query + (start,))
+
+        if key is not None:
+            queryset = self._seek(queryset, ordering, key)[:end - start]
+        else:
+            queryset = queryset[start:end]
+
+        rows = []
+        values = None
+        for values in queryset.values_list(*self._get_fields(ordering)):
+            rows.append(self._create_row(values))
+
+        if values is not None and self._keyset:
+            self._remember(query + (start + len(rows),), values[len(self.columns) + 1:])
+
+        return rows
+
+    def _remember(self, position, key):
+        """Remembers the key of the last row before the passed position.
+        """
+        if None in key:
+            return
+
+        self._keys[position] = key
+        while len(self._keys) > self.max_keys:
+            self._keys.popitem(last=False)
+
+    def _seek(self, queryset, ordering, key):
+        """Filters the queryset for the rows after the passed key.
+        """
+        condition = None
+        for i, field in enumerate(ordering):
+            lookup = "lt" if field.startswith("-") else "gt"
+            q = Q(**{"{}__{}".format(field.lstrip("-"), lookup): key[i]})
+            for former, value in zip(ordering[:i], key[:i]):
+                q &= Q(**{former.lstrip("-"): value})
+            condition = q if condition is None else condition | q
+        return queryset.filter(condition)
+
+
+def _get_filters_key(filters):
+    """Returns a hashable key for the passed filters.
+    """
+    if not filters:
+        return ()
+    return tuple(sorted(filters.items()))
+
 
 class Table(Component):
     """A HTML table
@@ -404,14 +757,45 @@ class Table(Component):
 
         data_provider
             The data provider which provides the rows and columns of the table
+
+        virtual
+            If true the rows are rendered straight from the data provider
+            without creating components. Rows are only created as components
+            when they are requested by ``get_row``. The events of the rows are
+            sent to the table (``component_id``) with the id of the row
+            (``element_id``).
+
+        scroll
+            The amount of rows which are loaded at once, when the table is
+            scrolled (infinite scrolling). The rows are appended to the table
+            without rerendering it. Scrolling tables are always virtual and
+            not paginated.
+
+        sortable
+            If true the rows can be ordered by clicking on the headers.
+
+        filterable
+            If true the headers get inputs to filter the rows.
     """
     template = "cba/components/table.html"
+    rows_template = "cba/components/table_rows.html"
 
-    def __init__(self, headers=None, pagination=None, page=1, label=None, data_provider=None, *args, **kwargs):
+    def __init__(self, headers=None, pagination=None, page=1, label=None, data_provider=None,
+                 virtual=False, scroll=None, sortable=False, filterable=False, *args, **kwargs):
         self.label = label
         self.page = page
-        self.pagination = pagination
+        self.pagination = None if scroll else pagination
         self.data_provider = data_provider
+        self.virtual = virtual or bool(scroll)
+        self.scroll = scroll
+        self.sortable = sortable
+        self.filterable = filterable
+
+        # The index of the column the rows are ordered by and the filters
+        # (column index -> value).
+        self.order_by = None
+        self.reverse = False
+        self.filters = {}
 
         if headers:
             self.headers = headers
@@ -421,49 +805,134 @@ class Table(Component):
         super(Table, self).__init__(*args, **kwargs)
 
     def total_rows(self):
+        if self.filters:
+            return self.data_provider.total_rows(filters=self.filters)
         return self.data_provider.total_rows()
 
-    def load_data(self, start=None, end=None):
-        definitions = self.data_provider.get_column_definitions()
+    def get_rows(self, start, end):
+        """Returns the rows from start to end of the data provider. The data
+        provider is only asked for ordered or filtered rows if the table is
+        ordered or filtered.
+        """
+        kwargs = {}
+        if self.order_by is not None:
+            kwargs["order_by"] = self.order_by
+            kwargs["reverse"] = self.reverse
+        if self.filters:
+            kwargs["filters"] = self.filters
+        return self.data_provider.get_rows(start, end, **kwargs)
 
+    def load_data(self, start=None, end=None):
         self.clear()
 
+        # Virtual rows are rendered straight from the data provider.
+        if self.virtual:
+            return
+
+        definitions = self.data_provider.get_column_definitions()
+
         if start is None and end is None:
             range = self.get_range(page=1)
             start = range["start"]
             end = range["end"]
 
-        for row in self.data_provider.get_rows(start, end):
-            table_row = TableRow(
-                id=row.get("id"),
-                component_value=row.get("component_value"),
-                css_class=row.get("css_class"),
-                selected=row.get("selected"),
-                handler=row.get("handler"),
-            )
+        for row in self.get_rows(start, end):
+            self.add_component(self._create_row(row, definitions))
 
-            # A TableColumn can have components or simple text.
+    def get_row(self, id):
+        """Returns the row with the passed id as ``TableRow``. Within a virtual
+        table the row is created from the data provider and added to the
+        table, hence it can be changed and refreshed.
+        """
+        row = self.get_component(id, direct_only=True, with_root=False)
+        if row is not None or not self.virtual:
+            return row
+
+        data = self.data_provider.get_row(id)
+        if data is None:
+            return None
+
+        row = self._create_row(data, self.data_provider.get_column_definitions())
+        self.add_component(row)
+        return row
+
+    def render_rows(self, start=None, end=None):
+        """Renders rows of a virtual table. Rows which have been created by
+        ``get_row`` are rendered as components.
+
+        start, end
+            The range of the rows. Defaults to the current page.
+        """
+        definitions = self.data_provider.get_column_definitions()
+        if start is None and end is None:
+            range = self.get_range(self.page)
+            start = range["start"]
+            end = range["end"]
+
+        rows = []
+        for row in self.get_rows(start, end):
+            component = self._components.get(row.get("id"))
+            if component is not None:
+                rows.append({"html": component.render()})
+                continue
+
+            columns = []
             for i, column in enumerate(row["data"]):
+                definition = self._get_definition(definitions, i)
                 if isinstance(column, Component):
-                    table_column = TableColumn(initial_components=[column])
+                    columns.append(column.render())
+                elif definition:
+                    columns.append(definition(value=column).render())
+                else:
+                    columns.append(column)
+
+            rows.append({
+                "id": row.get("id"),
+                "component_value": row.get("component_value"),
+                "css_class": row.get("css_class"),
+                "selected": row.get("selected"),
+                "handler": row.get("handler") or {},
+                "columns": columns,
+            })
+
+        return render_template(self.rows_template, {
+            "self": self,
+            "rows": rows,
+        })
+
+    def _create_row(self, row, definitions):
+        table_row = TableRow(
+            id=row.get("id"),
+            component_value=row.get("component_value"),
+            css_class=row.get("css_class"),
+            selected=row.get("selected"),
+            handler=row.get("handler"),
+        )
+
+        # A TableColumn can have components or simple text.
+        for i, column in enumerate(row["data"]):
+            if isinstance(column, Component):
+                table_column = TableColumn(initial_components=[column])
+            else:
+                definition = self._get_definition(definitions, i)
+                if not definition:
+                    table_column = TableColumn(content=column)
                 else:
-                    try:
-                        definition = definitions[i]
-                    except (IndexError, TypeError):
-                        definition = None
+                    table_column = TableColumn(
+                        initial_components=[definition(
+                            value=column
+                        )]
+                    )
 
-                    if not definition:
-                        table_column = TableColumn(content=column)
-                    else:
-                        table_column = TableColumn(
-                            initial_components=[definition(
-                                value=column
-                            )]
-                        )
+            table_row.add_component(table_column)
 
-                table_row.add_component(table_column)
+        return table_row
 
-            self.add_component(table_row)
+    def _get_definition(self, definitions, i):
+        try:
+            return definitions[i]
+        except (IndexError, TypeError):
+            return None
 
     def has_pagination(self):
         """Returns True if the table is paginated
@@ -484,7 +953,7 @@ class Table(Component):
     def clear(self):
         """Deletes all rows of the table.
         """
-        self._components.clear()
+        self._remove_components()
 
     def get_pages_range(self):
         """Returns the range of pages which are displayed for pagination.
@@ -494,7 +963,10 @@ class Table(Component):
     def get_range(self, page):
         """Returns the range of rows which should be displayed
         """
-        if self.has_pagination():
+        if self.scroll:
+            start = 0
+            end = self.scroll
+        elif self.has_pagination():
             start = self.pagination * (page - 1)
             end = self.pagination * page
         else:
@@ -503,6 +975,23 @@ class Table(Component):
 
         return {"start": start, "end": end}
 
+    def get_columns(self):
+        """Returns the headers with their order and filter.
+        """
+        columns = []
+        for i, header in enumerate(self.headers or []):
+            if self.order_by == i:
+                order = "descending" if self.reverse else "ascending"
+            else:
+                order = None
+            columns.append({
+                "index": i,
+                "header": header,
+                "order": order,
+                "filter": self.filters.get(i, ""),
+            })
+        return columns
+
     def get_selected_rows(self):
         result = []
         for row in self.components:
@@ -520,6 +1009,7 @@ class Table(Component):
         """
         return self.page < ((self.total_rows() / self.pagination) - 1)
 
+    @event_handler
     def handle_pagination(self):
         """Handles the clicks for pagination.
         """
@@ -533,11 +1023,57 @@ class Table(Component):
 
         self.set_page(page)
 
+    @event_handler
+    def handle_sort(self):
+        """Handles the clicks on headers. The browser sends the index of the
+        column as ``component_value``. A second click reverses the order.
+        """
+        column = int(self.component_value)
+        if self.order_by == column:
+            self.reverse = not self.reverse
+        else:
+            self.order_by = column
+            self.reverse = False
+
+        self.set_page(1)
+
+    @event_handler
+    def handle_filter(self):
+        """Handles changes of the filter inputs. The values are taken from
+        the request, unchanged inputs are not sent.
+        """
+        request = get_request()
+        filters = dict(self.filters)
+        for i in range(len(self.headers or [])):
+            value = request.POST.get("{}-filter-{}".format(self.id, i))
+            if value is None:
+                continue
+            if value:
+                filters[i] = value
+            else:
+                filters.pop(i, None)
+
+        self.filters = filters
+        self.set_page(1)
+
+    @event_handler
+    def handle_scroll(self):
+        """Handles the scrolling of the table. Appends the next rows to the
+        table. The browser sends the amount of displayed rows as
+        ``component_value``.
+        """
+        start = int(self.component_value)
+        self.append_html(
+            self.render_rows(start, start + self.scroll),
+            selector="#{} > tbody".format(self.id),
+        )
+
 
 class TableRow(Component):
     """A table row.
     """
     template = "cba/components/table_row.html"
+    reactive_attributes = Component.reactive_attributes | frozenset(["selected"])
 
     def __init__(self, selected=False, *args, **kwargs):
         super(TableRow, self).__init__(*args, **kwargs)
@@ -568,14 +1104,54 @@ class TabItem(Component):
 
         title
             The title of the tab item.
+
+    Lazy tab items, which are not active, are rendered as placeholder. Their
+    sub components are created and their body is loaded when the tab item is
+    activated within the browser. The rendered body is cached by the browser
+    and by the server (see ``cba.rendering.get_render_cache``) until a
+    component within the tab item is changed.
     """
     template = "cba/components/tab_item.html"
+    placeholder_template = "cba/components/tab_item_placeholder.html"
 
     def __init__(self, title="", active=False, *args, **kwargs):
         super(TabItem, self).__init__(*args, **kwargs)
         self.active = active
         self.title = title
 
+        # The key of the rendered body of lazy tab items, which is renewed
+        # when a component within the tab item is changed.
+        self.body_key = uuid.uuid4().hex if self.lazy else None
+
+    def is_hidden(self):
+        return not self.active
+
+    def is_placeholder(self):
+        return self.lazy and not self.active
+
+    def render(self):
+        if not self.lazy or not self.active:
+            return super(TabItem, self).render()
+
+        cache = get_render_cache()
+        key = "tab-item-{}".format(self.body_key)
+        html = cache.get(key)
+        if html is None:
+            html = super(TabItem, self).render()
+            cache.set(key, html)
+        return html
+
+    @event_handler
+    def handle_activate(self):
+        """Activates the tab item, which has been activated within the
+        browser. It is rendered unless the browser has loaded its body
+        already (``component_value`` is ``loaded``).
+        """
+        for item in self.parent.components:
+            item.active = item is self
+        if self.component_value != "loaded":
+            self.refresh()
+
 
 class Textarea(Component):
     """A HTML Textarea
@@ -593,6 +1169,7 @@ class Textarea(Component):
             The current value of the text area.
     """
     template = "cba/components/textarea.html"
+    reactive_attributes = Component.reactive_attributes | frozenset(["value", "error"])
 
     def __init__(self, label=None, value="", error=None, rows=10, *args, **kwargs):
         super(Textarea, self).__init__(*args, **kwargs)
@@ -632,6 +1209,8 @@ class TextInput(Component):
             The current value of the text input.
     """
     template = "cba/components/text_input.html"
+    # The template doesn't render displayed, disabled and css_class.
+    reactive_attributes = frozenset(["value", "error"])
 
     def __init__(self, id=None, value="", label=None, placeholder=None,
                  error=None, icon=None, icon_position="right", select_text=False,
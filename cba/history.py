@@ -0,0 +1,407 @@
+import copy
+import logging
+import uuid
+
+from cba import ContextLocal
+
+from . stores import get_tree_store
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+logger = logging.getLogger(__name__)
+
+_journal = ContextLocal("cba_journal")
+
+# Attributes which are only used during the current request. They are not
+# recorded within the journal and they are kept when a state is swapped in.
+UNTRACKED = frozenset(["_appends", "_dirty", "_messages", "_index", "_updates"])
+
+
+def get_journal():
+    """Returns the journal which records changes of the current event or
+    ``None``.
+    """
+    return _journal.get()
+
+
+def copy_state(state):
+    """Returns a copy of the passed attribute dictionary without untracked
+    attributes. Dictionaries, lists and sets are copied shallowly, as well as
+    values which define ``__copy__`` (e.g. table data providers). All other
+    values are shared.
+    """
+    result = {}
+    for name, value in state.items():
+        if name in UNTRACKED:
+            continue
+        if isinstance(value, dict):
+            value = value.copy()
+        elif isinstance(value, (list, set)):
+            value = type(value)(value)
+        elif hasattr(type(value), "__copy__"):
+            value = copy.copy(value)
+        result[name] = value
+    return result
+
+
+class Journal(object):
+    """Records the state of components before they are changed for the first
+    time within an event (copy on write).
+
+    Components call ``touch`` before they are changed. Only the first call per
+    component copies its attributes, subsequent calls are for free. Components
+    which are created while the journal is active are not recorded at all, as
+    they don't exist within the former state.
+
+    The journal is activated with the ``with`` statement::
+
+        with Journal() as journal:
+            component.value = "Hello"
+    """
+    def __init__(self):
+        self.records = []
+        self._recorded = set()
+        self._created = set()
+
+    def __enter__(self):
+        _journal.set(self)
+        return self
+
+    def __exit__(self, *args):
+        _journal.set(None)
+
+    def created(self, component):
+        """Registers a component which has been created within the event.
+        """
+        self._created.add(id(component))
+
+    def touch(self, component, name=None, value=None):
+        """Records the state of the passed component before it is changed.
+
+        component
+            The component which is about to be changed.
+
+        name, value
+            The attribute and the new value. When given and the value is
+            equal to the current one nothing is recorded.
+        """
+        key = id(component)
+        if key in self._recorded or key in self._created:
+            return
+
+        if name is not None:
+            if name in UNTRACKED:
+                return
+            try:
+                if component.__dict__[name] == value:
+                    return
+            except Exception:
+                pass
+
+        self._recorded.add(key)
+        self.records.append((component, component._get_state()))
+
+    def __len__(self):
+        return len(self.records)
+
+
+class StateNotFound(KeyError):
+    """Raised if a state does not exist (anymore) within the history.
+    """
+
+
+class History(object):
+    """The history states of one component tree.
+
+    Only the current state is kept as a complete component tree (``root``).
+    For all other states the history stores deltas: the states of the
+    components which are different to the neighbouring state. Hence, the
+    costs of an event grow with the amount of changed components rather than
+    with the size of the tree.
+
+    root
+        The root component of the tree.
+
+    max_depth
+        The maximal amount of states. Defaults to ``None`` (unlimited).
+
+    max_bytes
+        The maximal size of all deltas in bytes. Defaults to ``None``
+        (unlimited).
+
+    If one of the limits is exceeded, the least recently used states are
+    evicted. The current state is never evicted.
+    """
+    def __init__(self, root, max_depth=None, max_bytes=None):
+        self.root = root
+        self.state = 0
+        self.max_depth = max_depth
+        self.max_bytes = max_bytes
+
+        # Counts the changes of the history, hence it needs only be stored
+        # again if the version has been changed.
+        self.version = 0
+
+        # The sequence number of the last handled request of the tab.
+        self.sequence = 0
+
+        # The HTML which has been sent to the browser last by component id
+        # (see cba.patch).
+        self.sent = None
+
+        # The existing states in ascending order.
+        self._states = [0]
+
+        # Delta between state k and the next existing state. If k is lower
+        # than the current state it holds the states of components within k,
+        # otherwise the states within the next state.
+        self._deltas = {}
+
+        # The approximated sizes of the deltas in bytes.
+        self._sizes = {}
+
+        # Last usage of the states for LRU eviction.
+        self._clock = 0
+        self._used = {0: 0}
+
+    def __contains__(self, state):
+        return state in self._used
+
+    def __len__(self):
+        return len(self._states)
+
+    @property
+    def size(self):
+        """The approximated size of all deltas in bytes.
+        """
+        return sum(self._sizes.values())
+
+    @property
+    def states(self):
+        """The existing states in ascending order.
+        """
+        return list(self._states)
+
+    def checkout(self, state):
+        """Makes the passed state the current one and returns its root.
+
+        Raises ``StateNotFound`` if the state doesn't exist (anymore).
+        """
+        if state not in self:
+            raise StateNotFound("State {} does not exist".format(state))
+
+        current = self._states.index(self.state)
+        target = self._states.index(state)
+
+        while current > target:
+            current -= 1
+            self._swap(self._states[current])
+
+        while current < target:
+            self._swap(self._states[current])
+            current += 1
+
+        if self.state != state:
+            self.root._reindex()
+            self.version += 1
+
+        self.state = state
+        self._use(state)
+        return self.root
+
+    def commit(self, journal, state, create_state=False):
+        """Stores the changes of an event, which has been applied to the
+        current state.
+
+        journal
+            The journal which has recorded the changes.
+
+        state
+            The state the event has been applied to. Must be the current
+            state.
+
+        create_state
+            If True the changes create the new state ``state + 1`` and all
+            states after it are removed. Otherwise the changes are applied to
+            ``state`` itself.
+        """
+        if state != self.state:
+            raise ValueError("State {} is not the current state".format(state))
+
+        if create_state or len(journal):
+            self.version += 1
+
+        if create_state:
+            for k in self._states[self._states.index(state) + 1:]:
+                self._states.remove(k)
+                del self._used[k]
+                if k in self._deltas:
+                    self._set_delta(k, None)
+            self._set_delta(state, journal.records)
+            self.state = state + 1
+            self._states.append(self.state)
+            self._use(self.state)
+        else:
+            # The neighbouring states didn't contain the changes. Hence we add
+            # the former states of the changed components to their deltas,
+            # unless the deltas already know them.
+            index = self._states.index(state)
+            for k in self._states[max(index - 1, 0):index + 1]:
+                if k in self._deltas:
+                    self._set_delta(k, _merge(self._deltas[k], journal.records))
+
+        self._evict()
+
+        logger.debug("History state {}: {} component(s) recorded, {} state(s), {} bytes".format(
+            self.state, len(journal), len(self), self.size))
+
+    def _evict(self):
+        """Evicts the least recently used states until the limits are kept.
+        """
+        while len(self._states) > 1 and (
+            (self.max_depth and len(self._states) > self.max_depth) or
+            (self.max_bytes and self.size > self.max_bytes)
+        ):
+            state = min(
+                (k for k in self._states if k != self.state),
+                key=lambda k: self._used[k],
+            )
+            logger.debug("History evicts state {}".format(state))
+            self._remove(state)
+
+    def _remove(self, state):
+        """Removes the passed state. The deltas of the neighbouring states are
+        merged into one.
+        """
+        index = self._states.index(state)
+        previous = self._states[index - 1] if index > 0 else None
+        after = state in self._deltas
+
+        if previous is not None and after:
+            if state < self.state:
+                # Both deltas hold the lower states, keep the lowest.
+                delta = _merge(self._deltas[previous], self._deltas[state])
+            else:
+                # Both deltas hold the upper states, keep the uppermost.
+                delta = _merge(self._deltas[state], self._deltas[previous])
+            self._set_delta(previous, delta)
+        elif previous is not None:
+            self._set_delta(previous, None)
+
+        if after:
+            self._set_delta(state, None)
+
+        self._states.remove(state)
+        del self._used[state]
+
+    def _set_delta(self, state, delta):
+        if delta is None:
+            del self._deltas[state]
+            del self._sizes[state]
+        else:
+            self._deltas[state] = delta
+            self._sizes[state] = measure(delta)
+
+    def _swap(self, k):
+        self._deltas[k] = [
+            (component, component._swap_state(state))
+            for component, state in self._deltas[k]
+        ]
+
+    def _use(self, state):
+        self._clock += 1
+        self._used[state] = self._clock
+
+
+class HistoryStore(object):
+    """Stores the histories of the tabs of a session within the tree store
+    (see ``cba.stores``). Every page request (tab) gets a history with its own
+    key, which is sent with the events of the tab. The session only holds the
+    keys of its tabs.
+
+    request
+        The current request.
+
+    store
+        The tree store. Defaults to ``cba.stores.get_tree_store()``.
+    """
+    session_key = "cba-tabs"
+
+    # Maximal amount of tabs per session. The histories of the oldest tabs
+    # are deleted.
+    max_tabs = 20
+
+    def __init__(self, request, store=None):
+        self.request = request
+        self.store = store or get_tree_store()
+        self.tab = None
+
+        # The version of the loaded history.
+        self.version = None
+
+    def create(self, history):
+        """Stores the passed history as history of a new tab and returns the
+        key of the tab.
+        """
+        tabs = self.request.session.get(self.session_key, []) + [uuid.uuid4().hex]
+        for tab in tabs[:-self.max_tabs]:
+            self.store.delete(tab)
+
+        self.request.session[self.session_key] = tabs[-self.max_tabs:]
+        self.tab = tabs[-1]
+        self.version = None
+        self.save(history)
+        return self.tab
+
+    def load(self, tab=None):
+        """Returns the history of the passed tab or ``None``. Defaults to the
+        latest tab of the session.
+        """
+        tabs = self.request.session.get(self.session_key, [])
+        if tab is None and tabs:
+            tab = tabs[-1]
+        if tab not in tabs:
+            return None
+
+        self.tab = tab
+        history = self.store.load(tab)
+        self.version = None if history is None else history.version
+        return history
+
+    def save(self, history):
+        """Stores the passed history. A loaded history is only stored if no
+        other request has stored the history of the tab meanwhile. Returns
+        False if it hasn't been stored.
+        """
+        if not self.store.save(self.tab, history, self.version):
+            return False
+        self.version = history.version
+        return True
+
+
+def measure(delta):
+    """Returns the approximated size of the passed delta in bytes.
+    """
+    states = []
+    for component, state in delta:
+        # Referenced components are not part of the delta.
+        state = dict(state)
+        state.pop("parent", None)
+        state["_components"] = list(state.get("_components", ()))
+        states.append(state)
+    return len(pickle.dumps(states, pickle.HIGHEST_PROTOCOL))
+
+
+def _merge(delta, other):
+    """Returns the passed delta completed with the component states of
+    ``other`` which are not within ``delta``.
+    """
+    known = set(id(component) for component, state in delta)
+    return delta + [
+        (component, copy_state(state))
+        for component, state in other
+        if id(component) not in known
+    ]
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from cba.stores import get_tree_store
+
+
+class Command(BaseCommand):
+    help = "Deletes the expired histories of the tree store."
+
+    def handle(self, **options):
+        get_tree_store().clear_expired()
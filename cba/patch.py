@@ -0,0 +1,341 @@
+"""Patch responses: the HTML of a refreshed component is compared with the
+HTML which has been sent to the browser last and only the differences are
+sent as patch operations.
+
+The operations are lists: ``[kind, anchor, path, tag, ...]``. The target
+element is addressed by the id of the nearest element with an id (``anchor``,
+``None`` for the ``render`` element of the component) and the indexes of the
+element children below it (``path``); ``tag`` is the expected tag of the
+target. The kinds are:
+
+    ``["attr", anchor, path, tag, name, value]``
+        Sets an attribute, ``None`` removes it.
+
+    ``["html", anchor, path, tag, html]``
+        Sets the content of an element without element children.
+
+    ``["replace", anchor, path, tag, html]``
+        Replaces the element.
+
+    ``["insert", anchor, path, tag, index, html]``
+        Inserts an element before the element child with the index.
+
+    ``["remove", anchor, path, tag]``
+        Removes the element.
+"""
+import json
+import re
+from collections import OrderedDict
+
+from django.utils.six.moves.html_parser import HTMLParser
+
+# Elements which have no content and no end tag.
+VOID_ELEMENTS = frozenset([
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source",
+    "track", "wbr",
+])
+
+# Elements which whitespace is part of the content.
+RAW_ELEMENTS = frozenset(["pre", "script", "style", "textarea"])
+
+_ids = re.compile(r'\sid="([^"]+)"')
+
+
+class Element(object):
+    """An element of a parsed HTML fragment.
+    """
+    __slots__ = ("tag", "attrs", "children")
+
+    def __init__(self, tag, attrs):
+        self.tag = tag
+        self.attrs = attrs
+        self.children = []
+
+    @property
+    def id(self):
+        for name, value in self.attrs:
+            if name == "id":
+                return value
+        return None
+
+    @property
+    def elements(self):
+        return [child for child in self.children if isinstance(child, Element)]
+
+    @property
+    def classes(self):
+        for name, value in self.attrs:
+            if name == "class":
+                return (value or "").split()
+        return []
+
+
+class _Parser(HTMLParser):
+    def __init__(self):
+        try:
+            HTMLParser.__init__(self, convert_charrefs=False)
+        except TypeError:
+            HTMLParser.__init__(self)
+        self.root = Element(None, [])
+        self.stack = [self.root]
+
+    def handle_starttag(self, tag, attrs):
+        # Boolean attributes have the value "", as within the DOM.
+        element = Element(tag, [(name, "" if value is None else value) for name, value in attrs])
+        self.stack[-1].children.append(element)
+        if tag not in VOID_ELEMENTS:
+            self.stack.append(element)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_ELEMENTS:
+            self.stack.pop()
+
+    def handle_endtag(self, tag):
+        for i in range(len(self.stack) - 1, 0, -1):
+            if self.stack[i].tag == tag:
+                del self.stack[i:]
+                break
+
+    def handle_data(self, data):
+        self.stack[-1].children.append(data)
+
+    def handle_entityref(self, name):
+        self.stack[-1].children.append(u"&{};".format(name))
+
+    def handle_charref(self, name):
+        self.stack[-1].children.append(u"&#{};".format(name))
+
+
+def parse(html):
+    """Returns the nodes of the passed HTML fragment: elements and texts.
+    Comments are left out.
+    """
+    parser = _Parser()
+    parser.feed(html)
+    parser.close()
+    return parser.root.children
+
+
+def serialize(node):
+    """Returns the HTML of the passed node.
+    """
+    if not isinstance(node, Element):
+        return node
+
+    parts = [u"<", node.tag]
+    for name, value in node.attrs:
+        parts.append(u' {}="{}"'.format(name, _escape(value)))
+    parts.append(u">")
+    if node.tag not in VOID_ELEMENTS:
+        parts.extend(serialize(child) for child in node.children)
+        parts.append(u"</{}>".format(node.tag))
+    return u"".join(parts)
+
+
+def get_ids(html):
+    """Returns the ids of the elements within the passed HTML.
+    """
+    return _ids.findall(html)
+
+
+def diff(old, new):
+    """Returns the operations which patch the HTML ``old`` of a component
+    into ``new`` or ``None`` if the component has to be replaced.
+    """
+    old_nodes = parse(old)
+    new_nodes = parse(new)
+
+    old_root = _find_render(old_nodes)
+    new_root = _find_render(new_nodes)
+    if old_root is None or new_root is None or old_root.tag != new_root.tag:
+        return None
+
+    # Everything around the render element, e.g. scripts, must be the same,
+    # as only the render element is patched.
+    if _signature(old_nodes, old_root) != _signature(new_nodes, new_root):
+        return None
+
+    ops = []
+    if not _diff_element(old_root, new_root, None, [], ops):
+        return None
+    return ops
+
+
+def get_patch(old, new):
+    """Returns the operations which patch the HTML ``old`` of a component
+    into ``new`` or ``None`` if the complete HTML is smaller.
+    """
+    ops = diff(old, new)
+    if ops is None or len(json.dumps(ops)) >= len(new):
+        return None
+    return ops
+
+
+class SentHTML(object):
+    """The HTML of the components which has been sent to the browser last, by
+    component id. The least recently sent HTML is evicted if there are more
+    than ``max_bytes``.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._html = OrderedDict()
+
+    def __contains__(self, id):
+        return id in self._html
+
+    def get(self, id):
+        return self._html.get(id)
+
+    def set(self, id, html):
+        self.discard(id)
+        self._html[id] = html
+        self.size += len(html)
+        while self.size > self.max_bytes and self._html:
+            self.size -= len(self._html.popitem(last=False)[1])
+
+    def discard(self, id):
+        html = self._html.pop(id, None)
+        if html is not None:
+            self.size -= len(html)
+
+    def clear(self):
+        self._html.clear()
+        self.size = 0
+
+
+def _diff_element(old, new, anchor, path, ops):
+    """Adds the operations which patch the element ``old`` into ``new`` to
+    ``ops``. Returns False if the element has to be replaced.
+    """
+    if old.tag != new.tag or old.id != new.id:
+        return False
+
+    if old.tag == "script" or old.tag == "style":
+        return old.children == new.children
+
+    # The operations are only added if the element needn't be replaced.
+    result = []
+    old_attrs = dict(old.attrs)
+    new_attrs = dict(new.attrs)
+    for name, value in new.attrs:
+        if old_attrs.get(name) != value:
+            result.append(["attr", anchor, path, new.tag, name, value])
+    for name, value in old.attrs:
+        if name not in new_attrs:
+            result.append(["attr", anchor, path, new.tag, name, None])
+
+    raw = new.tag in RAW_ELEMENTS
+    old_elements = old.elements
+    new_elements = new.elements
+    if _texts(old, raw) != _texts(new, raw):
+        if old_elements or new_elements:
+            return False
+        html = u"".join(serialize(child) for child in new.children)
+        result.append(["html", anchor, path, new.tag, html if raw else u" ".join(html.split())])
+        return _extend(ops, result, new)
+
+    old_keys = [(child.tag, child.id) for child in old_elements]
+    new_keys = [(child.tag, child.id) for child in new_elements]
+    if old_keys == new_keys:
+        for index, (old_child, new_child) in enumerate(zip(old_elements, new_elements)):
+            _diff_child(old_child, new_child, anchor, path, index, result)
+        return _extend(ops, result, new)
+
+    # Children which have ids are removed and inserted, as long as the order
+    # of the remaining ones is the same.
+    old_ids = [child.id for child in old_elements]
+    new_ids = [child.id for child in new_elements]
+    if None in old_ids or None in new_ids or \
+            len(set(old_ids)) != len(old_ids) or len(set(new_ids)) != len(new_ids):
+        return False
+
+    common = set(old_ids) & set(new_ids)
+    if [id for id in old_ids if id in common] != [id for id in new_ids if id in common]:
+        return False
+
+    for child in old_elements:
+        if child.id not in common:
+            result.append(["remove", child.id, [], child.tag])
+    for index, child in enumerate(new_elements):
+        if child.id not in common:
+            result.append(["insert", anchor, path, new.tag, index, serialize(child)])
+
+    old_children = dict((child.id, child) for child in old_elements)
+    for index, child in enumerate(new_elements):
+        if child.id in common:
+            _diff_child(old_children[child.id], child, anchor, path, index, result)
+    return _extend(ops, result, new)
+
+
+def _extend(ops, result, element):
+    """Adds the operations of the element to ``ops``. Returns False if the
+    element has to be replaced: inline scripts (e.g. the initialization of a
+    dropdown) only run when they are inserted, hence an element with script
+    children is replaced if anything within it has been changed.
+    """
+    if result and any(isinstance(child, Element) and child.tag == "script" for child in element.children):
+        return False
+    ops.extend(result)
+    return True
+
+
+def _diff_child(old, new, anchor, path, index, ops):
+    if new.id is not None:
+        anchor, path = new.id, []
+    else:
+        path = path + [index]
+
+    if not _diff_element(old, new, anchor, path, ops):
+        ops.append(["replace", anchor, path, old.tag, serialize(new)])
+
+
+def _texts(element, raw):
+    """Returns the texts of the element with the amount of element children
+    before them. Whitespace is ignored, unless it is part of the content.
+    """
+    texts = []
+    elements = 0
+    for child in element.children:
+        if isinstance(child, Element):
+            elements += 1
+        else:
+            text = child if raw else u" ".join(child.split())
+            if text:
+                texts.append((elements, text))
+    return texts
+
+
+def _find_render(nodes):
+    """Returns the first element with the class ``render``, which is replaced
+    by the browser.
+    """
+    stack = list(reversed(nodes))
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Element):
+            if "render" in node.classes:
+                return node
+            stack.extend(reversed(node.children))
+    return None
+
+
+def _signature(nodes, skip):
+    """Returns the comparable content of the passed nodes without ``skip``.
+    """
+    result = []
+    for node in nodes:
+        if node is skip:
+            result.append(None)
+        elif isinstance(node, Element):
+            result.append((node.tag, node.attrs, _signature(node.children, skip)))
+        else:
+            text = u" ".join(node.split())
+            if text:
+                result.append(text)
+    return result
+
+
+def _escape(value):
+    return value.replace(u"&", u"&amp;").replace(u'"', u"&quot;").replace(u"<", u"&lt;").replace(u">", u"&gt;")
@@ -0,0 +1,138 @@
+import logging
+import time
+from multiprocessing.pool import ThreadPool
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . stores import check_shared_cache
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_lock = Lock()
+
+
+def get_pool():
+    """Returns the thread pool for background work. The amount of threads is
+    given by the setting ``CBA_PUSH_WORKERS`` (defaults to 4).
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPool(getattr(settings, "CBA_PUSH_WORKERS", 4))
+    return _pool
+
+
+class Mailbox(object):
+    """The results of the background work of one tab. The results are stored
+    within Django's cache, hence they can be taken by any process.
+
+        tab
+            The key of the tab.
+
+        cache
+            The alias of the cache. Defaults to the setting
+            ``CBA_PUSH_CACHE`` or ``default``. It must be shared between
+            processes, see ``cba.stores.check_shared_cache``.
+    """
+    def __init__(self, tab, cache=None):
+        alias = cache or getattr(settings, "CBA_PUSH_CACHE", "default")
+        check_shared_cache(alias, "CBA_PUSH_CACHE")
+        self.tab = tab
+        self.alias = alias
+        self.timeout = getattr(settings, "SESSION_COOKIE_AGE", None)
+
+    @property
+    def cache(self):
+        """The cache of the results. It is looked up on every use, as cache
+        connections are per thread and the mailbox is used within the threads
+        of the pool.
+        """
+        return caches[self.alias]
+
+    @property
+    def pending(self):
+        """The amount of results which have not been taken yet, including the
+        ones of unfinished work.
+        """
+        return self._get("submitted") - self._get("taken")
+
+    def submit(self):
+        """Announces a result, i.e. work has been started.
+        """
+        self._incr("submitted")
+
+    def put(self, result):
+        """Adds the result of finished work.
+        """
+        self.cache.set(self._get_key(self._incr("put")), result, self.timeout)
+
+    def take(self):
+        """Returns all results, which have not been taken yet, in the order
+        they have been added.
+
+        Every result is claimed with ``cache.add`` before it is taken, hence
+        concurrent requests of the tab never take the same result.
+        """
+        taken = self._get("taken")
+        put = self._get("put")
+
+        results = []
+        for i in range(taken + 1, put + 1):
+            claim = self._get_key("claim-{}".format(i))
+            if not self.cache.add(claim, True, self.timeout):
+                continue
+
+            key = self._get_key(i)
+            result = self.cache.get(key)
+            if result is None:
+                # The result is being put, it is taken by the next request.
+                self.cache.delete(claim)
+                break
+            self.cache.delete(key)
+            results.append(result)
+
+        if results:
+            self._incr("taken", len(results))
+        return results
+
+    def wait(self, timeout, interval=0.1):
+        """Waits for results, at most ``timeout`` seconds. Returns True if
+        there are results.
+        """
+        end = time.time() + timeout
+        while True:
+            # Results can be claimed out of order, hence every result which
+            # has not been counted as taken is checked. The counter is
+            # incremented before the result is stored.
+            keys = [self._get_key(i) for i in range(self._get("taken") + 1, self._get("put") + 1)]
+            if keys and self.cache.get_many(keys):
+                return True
+            if time.time() >= end:
+                return False
+            time.sleep(interval)
+
+    def _get(self, name):
+        return self.cache.get(self._get_key(name), 0)
+
+    def _incr(self, name, delta=1):
+        key = self._get_key(name)
+        self.cache.add(key, 0, self.timeout)
+        return self.cache.incr(key, delta)
+
+    def _get_key(self, name):
+        return "cba-push-{}-{}".format(self.tab, name)
+
+
+def run_work(mailbox, component_id, callback, errback, func, args, kwargs):
+    """Runs background work and puts the result into the mailbox.
+    """
+    try:
+        result = func(*args, **kwargs)
+    except Exception as e:
+        logger.exception("Background work {} failed".format(func))
+        mailbox.put((component_id, errback, e))
+    else:
+        mailbox.put((component_id, callback, result))
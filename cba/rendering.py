@@ -0,0 +1,225 @@
+import hashlib
+import re
+from collections import OrderedDict
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.template.context import make_context
+from django.template.loader import get_template
+from django.utils.encoding import force_text
+from django.utils.safestring import mark_safe
+
+from cba import ContextLocal
+
+from . history import UNTRACKED
+
+_context = ContextLocal("cba_context")
+_render_cache = None
+
+# Attributes which are not part of the fingerprint of a component.
+NOT_RENDERED = UNTRACKED | frozenset([
+    "_components", "initial_components", "parent", "element_id", "component_id", "source_id", "key_code",
+])
+
+# Compiled templates by name
+_templates = {}
+
+# Elements which whitespace is part of the content.
+_raw = re.compile(r"(<(pre|script|style|textarea)\b.*?</\2\s*>)", re.DOTALL | re.IGNORECASE)
+_tag = re.compile(r"""(<(?:[^>"']|"[^"]*"|'[^']*')*>)""")
+_whitespace = re.compile(r"\s+")
+
+
+def get_compiled_template(name):
+    """Returns the compiled template with the passed name. Templates are
+    loaded and compiled only once, unless template debugging is on.
+    """
+    template = _templates.get(name)
+    if template is None:
+        template = get_template(name).template
+        if not template.engine.debug:
+            _templates[name] = template
+    return template
+
+
+def render_template(name, values):
+    """Renders the template with the passed name and values.
+
+    The outermost call creates the context. Nested calls, i.e. components
+    which are rendered within the template of their parent, render with a
+    new scope of this context instead of creating their own one. The output
+    is the same as of ``render_to_string``, but the whitespace is collapsed
+    by the outermost call, unless the setting ``CBA_COLLAPSE_WHITESPACE`` is
+    ``False``.
+    """
+    template = get_compiled_template(name)
+    context = _context.get()
+
+    if context is not None:
+        # A new scope, which is the same as ``context.new(values)`` without
+        # copying the context.
+        dicts = context.dicts
+        context.dicts = [dicts[0], values]
+        try:
+            return template.render(context)
+        finally:
+            context.dicts = dicts
+
+    context = make_context(values, autoescape=template.engine.autoescape)
+    _context.set(context)
+    try:
+        html = template.render(context)
+    finally:
+        _context.set(None)
+
+    if getattr(settings, "CBA_COLLAPSE_WHITESPACE", True):
+        html = mark_safe(collapse_whitespace(html))
+    return html
+
+
+def collapse_whitespace(html):
+    """Replaces runs of whitespace within the text of the passed HTML by a
+    single space, which renders the same. Tags, including their attribute
+    values, and the content of ``pre``, ``script``, ``style`` and ``textarea``
+    elements are kept.
+    """
+    parts = _raw.split(html)
+    result = []
+    # split returns the text, the raw element and its tag name alternately.
+    for i in range(0, len(parts), 3):
+        # The tags are at the odd indexes.
+        for j, part in enumerate(_tag.split(parts[i])):
+            result.append(part if j % 2 else _whitespace.sub(u" ", part))
+        if i + 1 < len(parts):
+            result.append(parts[i + 1])
+    return u"".join(result)
+
+
+class RenderCache(object):
+    """Base class of render caches, which store rendered HTML fragments by
+    the fingerprint of the component. Counts hits and misses.
+    """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Returns the HTML with the passed key or ``None``.
+        """
+        html = self._get(key)
+        if html is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return html
+
+    def set(self, key, html):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def _get(self, key):
+        raise NotImplementedError
+
+
+class LocalRenderCache(RenderCache):
+    """Stores the fragments in process. The least recently used fragments are
+    evicted if there are more than ``max_entries``.
+    """
+    def __init__(self, max_entries=1000):
+        super(LocalRenderCache, self).__init__()
+        self.max_entries = max_entries
+        self._fragments = OrderedDict()
+        self._lock = Lock()
+
+    def set(self, key, html):
+        with self._lock:
+            self._fragments.pop(key, None)
+            self._fragments[key] = html
+            while len(self._fragments) > self.max_entries:
+                self._fragments.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._fragments.clear()
+
+    def _get(self, key):
+        with self._lock:
+            html = self._fragments.pop(key, None)
+            if html is not None:
+                self._fragments[key] = html
+        return html
+
+
+class DjangoRenderCache(RenderCache):
+    """Stores the fragments within Django's cache.
+
+        cache
+            The alias of the cache.
+
+        timeout
+            The timeout of the fragments. Defaults to the timeout of the
+            cache.
+    """
+    prefix = "cba-render-"
+
+    def __init__(self, cache, timeout=DEFAULT_TIMEOUT):
+        super(DjangoRenderCache, self).__init__()
+        self.cache = caches[cache]
+        self.timeout = timeout
+
+    def set(self, key, html):
+        self.cache.set(self.prefix + key, html, self.timeout)
+
+    def clear(self):
+        self.cache.clear()
+
+    def _get(self, key):
+        return self.cache.get(self.prefix + key)
+
+
+def get_render_cache():
+    """Returns the render cache. This is a ``DjangoRenderCache`` if the
+    setting ``CBA_RENDER_CACHE`` (the alias of a Django cache) is given,
+    otherwise a ``LocalRenderCache``.
+    """
+    global _render_cache
+    if _render_cache is None:
+        alias = getattr(settings, "CBA_RENDER_CACHE", None)
+        if alias:
+            _render_cache = DjangoRenderCache(alias)
+        else:
+            _render_cache = LocalRenderCache()
+    return _render_cache
+
+
+def set_render_cache(cache):
+    """Sets the render cache, e.g. a custom ``RenderCache``.
+    """
+    global _render_cache
+    _render_cache = cache
+
+
+def get_fingerprint(component):
+    """Returns the fingerprint of the passed component, which is built from
+    its class, its template and the representations of its attributes and
+    its sub components. Attributes which are not rendered, e.g. the parent,
+    are left out.
+    """
+    parts = []
+    stack = [component]
+    while stack:
+        component = stack.pop()
+        cls = type(component)
+        parts.append("{}.{}:{}".format(cls.__module__, cls.__name__, component.template))
+        for name, value in sorted(component.__dict__.items()):
+            if name in NOT_RENDERED:
+                continue
+            parts.append("{}={!r}".format(name, value))
+        stack.extend(reversed(component._components.values()))
+        parts.append(str(len(component._components)))
+
+    return hashlib.md5(u"\n".join(force_text(part) for part in parts).encode("utf-8")).hexdigest()
@@ -10,12 +10,56 @@ const CBA = {
         });
     },
 
-    collectComponents: () => {
+    // Inputs which have been changed since the last request: key -> counter
+    changedInputs: new Map(),
+    changeCounter: 0,
+
+    // Returns the key under which the value of an input is sent.
+    getInputKey: element => {
+        const type = element.attr('type');
+        if (type == 'checkbox' || type == 'radio') {
+            return element.attr('name');
+        }
+        return element.attr('id');
+    },
+
+    inputChanged: element => {
+        CBA.changeCounter += 1;
+        CBA.changedInputs.set(CBA.getInputKey(element), CBA.changeCounter);
+    },
+
+    // Returns the keys of changed inputs together with the passed ones.
+    getChangedInputs: inputs => {
+        const result = new Map(CBA.changedInputs);
+        for (const key of inputs || []) {
+            if (!result.has(key)) {
+                result.set(key, null);
+            }
+        }
+        return result;
+    },
+
+    // Forgets the sent inputs unless they have been changed again meanwhile.
+    resetChangedInputs: sent => {
+        for (const [key, counter] of sent) {
+            if (CBA.changedInputs.get(key) === counter) {
+                CBA.changedInputs.delete(key);
+            }
+        }
+    },
+
+    // Collects the values of all inputs or, if keys is given, of the inputs
+    // with these keys.
+    collectComponents: keys => {
         const object = new FormData();
 
         $('input.component, textarea.component, select').each(function() {
             const id = $(this).attr('id');
 
+            if (keys && !keys.has(CBA.getInputKey($(this)))) {
+                return;
+            }
+
             if ($(this).attr('type') == 'file') {
                 for (const file of $(this)[0].files) {
                     object.append(id, file);
@@ -59,6 +103,236 @@ const CBA = {
             } else {
                 $(html[0]).parents('.render:first').replaceWith(html[1]);
             }
+            CBA.cacheTabItem($(html[0]), html[1]);
+        }
+    },
+
+    // The bodies of lazy tab items by id and body key (see TabItem).
+    tabItems: new Map(),
+    maxTabItems: 50,
+
+    cacheTabItem: (element, html) => {
+        const key = element.attr('data-body-key');
+        if (!key || element.attr('data-placeholder')) {
+            return;
+        }
+        CBA.tabItems.delete(`${element.attr('id')}:${key}`);
+        CBA.tabItems.set(`${element.attr('id')}:${key}`, html);
+        if (CBA.tabItems.size > CBA.maxTabItems) {
+            CBA.tabItems.delete(CBA.tabItems.keys().next().value);
+        }
+    },
+
+    // Called when a tab item has been activated. The placeholder of a lazy
+    // tab item is replaced by its cached body. The activation is always sent
+    // to the server, which renders the body only if the browser hasn't
+    // loaded it (component_value).
+    loadTabItem: id => {
+        let element = $(`#${id}`);
+        let loaded = !element.attr('data-placeholder');
+        if (!loaded) {
+            const html = CBA.tabItems.get(`${id}:${element.attr('data-body-key')}`);
+            if (html) {
+                element.replaceWith(html);
+                element = $(`#${id}`);
+                loaded = true;
+            }
+        }
+        element.attr('component_value', loaded ? 'loaded' : id);
+        CBA.handleEvent(element, {type: 'load'});
+    },
+
+    // Returns the pairs of selectors and values of a compact list of ids and
+    // values (see CBAView.compact_responses).
+    expandCompact: values => {
+        const result = [];
+        for (let i = 0; i < (values || []).length; i += 2) {
+            result.push([`#${values[i]}`, values[i + 1]]);
+        }
+        return result;
+    },
+
+    // Applies the patches of refreshed components (see cba.patch). If the
+    // document doesn't match a patch, the current state is requested again
+    // without patches.
+    applyPatches: patches => {
+        for (const [selector, ops] of patches || []) {
+            if (!CBA.applyPatch(selector, ops)) {
+                CBA.reload(history.state || 0, true);
+                return;
+            }
+        }
+    },
+
+    applyPatch: (selector, ops) => {
+        let root = $(selector);
+        if (!root.hasClass('render')) {
+            root = root.parents('.render:first');
+        }
+        if (!root.length) {
+            return false;
+        }
+
+        for (const [kind, anchor, path, tag, ...args] of ops) {
+            let element = anchor === null ? root[0] : document.getElementById(anchor);
+            for (const index of path) {
+                element = element ? element.children[index] : null;
+            }
+            if (!element || element.tagName.toLowerCase() !== tag) {
+                return false;
+            }
+
+            if (kind === 'attr') {
+                const [name, value] = args;
+                if (value === null) {
+                    element.removeAttribute(name);
+                } else {
+                    element.setAttribute(name, value);
+                }
+                // The properties of form elements follow their attributes.
+                if (name === 'value') {
+                    element.value = value === null ? '' : value;
+                } else if (['checked', 'selected', 'disabled'].includes(name)) {
+                    element[name] = value !== null;
+                }
+            } else if (kind === 'html') {
+                element.innerHTML = args[0];
+                if (tag === 'textarea') {
+                    element.value = element.textContent;
+                }
+            } else if (kind === 'replace') {
+                $(element).replaceWith(args[0]);
+            } else if (kind === 'insert') {
+                const [index, html] = args;
+                const next = element.children[index];
+                if (next) {
+                    $(next).before(html);
+                } else {
+                    $(element).append(html);
+                }
+            } else if (kind === 'remove') {
+                $(element).remove();
+            } else {
+                return false;
+            }
+        }
+        return true;
+    },
+
+    // Applies changed attributes of components, which are not rendered again
+    // (see Component.reactive_attributes).
+    applyUpdates: updates => {
+        for (const [id, changes] of updates || []) {
+            const element = $(`#${id}`);
+            for (const [name, value] of Object.entries(changes)) {
+                const updater = CBA.updaters[name];
+                if (updater) {
+                    updater(element, value);
+                }
+            }
+        }
+    },
+
+    // Updaters of reactive attributes by name. They get the element with
+    // the id of the component and the new value.
+    updaters: {
+        displayed: (element, value) => {
+            const root = element.hasClass('render') ? element : element.parents('.render:first');
+            root.toggle(value);
+        },
+        disabled: (element, value) => {
+            element.prop('disabled', value);
+            element.closest('.ui.dropdown').toggleClass('disabled', value);
+        },
+        css_class: (element, [old, value]) => {
+            element.removeClass(old || '').addClass(value || '');
+        },
+        selected: (element, value) => {
+            element.toggleClass('selected', value);
+        },
+        value: (element, value) => {
+            element.val(value);
+        },
+        error: (element, value) => {
+            const root = element.hasClass('render') ? element : element.parents('.render:first');
+            let error = root.find('.error:first');
+            if (!value) {
+                error.remove();
+                return;
+            }
+            if (!error.length) {
+                error = $('<div class="error"></div>');
+                const input = element.parents('.ui.input:first');
+                error.insertBefore(input.length ? input : element);
+            }
+            error.text(value);
+        },
+    },
+
+    appendHTML: result => {
+        for (const html of result || []) {
+            // An empty result means there is nothing more to append.
+            if ($.trim(html[1]) === '') {
+                $(html[0]).closest('table.scroll').attr('data-complete', 'true');
+            } else {
+                $(html[0]).append(html[1]);
+            }
+        }
+    },
+
+    // Loads the next rows of scrolling tables, which end is visible.
+    scrollTables: () => {
+        $('table.scroll').each(function() {
+            const table = $(this);
+            if (table.attr('data-complete') || table.attr('data-loading')) {
+                return;
+            }
+            const bottom = table.offset().top + table.outerHeight();
+            if (bottom > $(window).scrollTop() + $(window).height() + 200) {
+                return;
+            }
+            table.attr('data-loading', 'true');
+            table.attr('component_value', table.find('> tbody > tr').length);
+            CBA.handleEvent(table, {type: 'scroll'}, () => {
+                table.removeAttr('data-loading');
+            });
+        });
+    },
+
+    // Messages of stale results, which are followed by the result of a later
+    // request (see enqueue), are dropped.
+    handleResult: (result, state, stale = false) => {
+        // The history has been expired on the server.
+        if (result.reload) {
+            window.location.reload();
+            return;
+        }
+
+        // The server has already handled a later request.
+        if (result.outdated) {
+            return;
+        }
+
+        // The requested state has been evicted on the server, which sends the
+        // current state instead.
+        if (result.state !== undefined) {
+            history.replaceState(result.state, null, `#${result.state}`);
+        } else if (state !== undefined) {
+            history.pushState(state, null, `#${state}`);
+        }
+
+        CBA.replaceHTML(result.html || CBA.expandCompact(result.h));
+        CBA.applyPatches(result.patches || CBA.expandCompact(result.p));
+        CBA.applyUpdates(result.updates);
+        CBA.appendHTML(result.append);
+        if (!stale) {
+            CBA.addMessages(result.messages);
+        }
+        CBA.scrollTables();
+
+        // Background work pushes its results to the tab.
+        if (result.push) {
+            CBA.subscribe();
         }
     },
 
@@ -75,20 +349,114 @@ const CBA = {
         }
     },
 
-    defaultAjaxAction: (element, event, handler, createState) => {
-        const data = CBA.collectComponents();
-        try {
-            data.append('source_id', event.originalEvent.dataTransfer.getData('text'));
-        } catch (e) {}
+    // The events of the tab, which wait for the request in flight. Only one
+    // request is sent at once, waiting events are sent together (batch).
+    queue: [],
+    busy: false,
+
+    // Maximal amount of events within one request.
+    maxBatch: 20,
+
+    // Numbers the requests of the tab. The server drops outdated requests.
+    sequence: 0,
+
+    // Events which replace a waiting event of the same kind and element.
+    coalescedEvents: ['keyup', 'mouseover', 'mouseout'],
+
+    // The request in flight.
+    current: null,
+
+    // Timers and last calls of debounced and throttled events.
+    timers: new Map(),
+    throttled: new Map(),
+
+    // Adds an item to the queue: either an event or a function which sends a
+    // request of its own (item.send). A waiting item with the same key is
+    // replaced by the passed one. If item.abort is true, the request in
+    // flight with the same key becomes stale (latest wins): its HTML and state
+    // are applied anyway, as the server has recorded them as sent, but its
+    // messages are dropped. The request itself is not aborted, as the server
+    // would handle it anyway: the queue waits until it has finished.
+    enqueue: item => {
+        const key = item.key === undefined ? null : item.key;
+        if (key !== null) {
+            const current = CBA.current;
+            if (item.abort && current && current.items.length === 1 && current.items[0].key === key) {
+                current.stale = true;
+            }
+            const waiting = CBA.queue.find(other => other.key === key);
+            if (waiting) {
+                Object.assign(waiting, item);
+                return;
+            }
+        }
+        CBA.queue.push(item);
+        CBA.dequeue();
+    },
 
-        const elementId = element.attr('id');
-        const componentId = element.attr('cid') || elementId;
-        const componentValue = element.attr('component_value') || componentId;
-        data.append('handler', handler);
-        data.append('element_id', elementId);
-        data.append('component_id', componentId);
-        data.append('component_value', componentValue);
-        data.append('key_code', event.keyCode);
+    // Sends the next request of the queue, if no request is in flight.
+    dequeue: () => {
+        if (CBA.busy || !CBA.queue.length) {
+            return;
+        }
+        CBA.busy = true;
+
+        let items;
+        if (CBA.queue[0].send) {
+            items = CBA.queue.splice(0, 1);
+        } else {
+            let end = CBA.queue.findIndex(item => item.send);
+            if (end === -1 || end > CBA.maxBatch) {
+                end = Math.min(CBA.queue.length, CBA.maxBatch);
+            }
+            items = CBA.queue.splice(0, end);
+        }
+
+        const request = CBA.current = {items, stale: false};
+        const done = () => {
+            CBA.current = null;
+            CBA.busy = false;
+            CBA.dequeue();
+        };
+
+        if (items[0].send) {
+            items[0].send(done, request);
+        } else {
+            CBA.sendEvents(items, done, request);
+        }
+    },
+
+    // Sends the passed events within one request.
+    sendEvents: (items, done, request) => {
+        // Only changed and explicitly requested inputs are sent, unless all
+        // inputs are requested.
+        let data;
+        let sent = null;
+        if (items.some(item => item.options.inputs === '*')) {
+            data = CBA.collectComponents();
+        } else {
+            let inputs = [];
+            for (const item of items) {
+                if (item.options.inputs) {
+                    inputs = inputs.concat(item.options.inputs.split(','));
+                }
+            }
+            sent = CBA.getChangedInputs(inputs);
+            data = CBA.collectComponents(sent);
+            data.append('partial', 'true');
+        }
+
+        if (items.length === 1) {
+            for (const [name, value] of Object.entries(items[0].event)) {
+                if (value != null) {
+                    data.append(name, value);
+                }
+            }
+        } else {
+            data.append('events', JSON.stringify(items.map(item => item.event)));
+        }
+
+        CBA.appendTab(data);
         data.append('csrfmiddlewaretoken', $('input[name=csrfmiddlewaretoken]').attr('value'));
 
         if (CBA.DEBUG) {
@@ -102,9 +470,183 @@ const CBA = {
             state = 1;
         }
 
+        const createState = items.some(item => item.createState);
         data.append('state', state);
-        data.append('create_state', createState)
+        data.append('create_state', createState);
+
+        CBA.post(data, {
+            success: result => {
+                // The inputs of dropped requests haven't been stored.
+                if (result.outdated) {
+                    return;
+                } else if (sent) {
+                    CBA.resetChangedInputs(sent);
+                } else {
+                    CBA.changedInputs.clear();
+                }
+                CBA.handleResult(result, createState ? state : undefined, request.stale);
+            },
+            complete: () => {
+                for (const item of items) {
+                    if (item.complete) {
+                        item.complete();
+                    }
+                }
+                done();
+            },
+        });
+    },
+
+    // Calls the passed function according to the debounce or throttle
+    // option (milliseconds) of the handler.
+    schedule: (key, options, fn) => {
+        const debounce = parseInt(options.debounce, 10);
+        const throttle = parseInt(options.throttle, 10);
 
+        if (key === null || !(debounce > 0 || throttle > 0)) {
+            fn();
+            return;
+        }
+
+        // Debounce: called when the events pause for the interval.
+        // Throttle: called at most once per interval with the latest event.
+        let wait = debounce;
+        if (!(debounce > 0)) {
+            wait = (CBA.throttled.get(key) || 0) + throttle - Date.now();
+        }
+
+        clearTimeout(CBA.timers.get(key));
+        const call = () => {
+            CBA.timers.delete(key);
+            CBA.throttled.set(key, Date.now());
+            fn();
+        };
+
+        if (wait <= 0) {
+            call();
+        } else {
+            CBA.timers.set(key, setTimeout(call, wait));
+        }
+    },
+
+    // The WebSocket of the tab and its requests, which wait for the response.
+    socket: null,
+    socketId: 0,
+    socketRequests: new Map(),
+
+    // Connects the WebSocket, if the view provides one.
+    connectSocket: () => {
+        const url = $('meta[name=cba-websocket]').attr('content');
+        if (!url || !window.WebSocket) {
+            return;
+        }
+        const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+        const socket = new WebSocket(`${protocol}//${window.location.host}${url}`);
+
+        socket.onopen = () => {
+            CBA.socket = socket;
+        };
+
+        socket.onmessage = e => {
+            const message = JSON.parse(e.data);
+            const request = CBA.socketRequests.get(message.id);
+            if (request) {
+                CBA.socketRequests.delete(message.id);
+                request.success(message.result);
+                request.complete();
+            }
+        };
+
+        // The waiting requests are lost, subsequent ones are sent by ajax.
+        socket.onclose = () => {
+            CBA.socket = null;
+            for (const request of CBA.socketRequests.values()) {
+                request.complete();
+            }
+            CBA.socketRequests.clear();
+        };
+    },
+
+    // Sends the passed data through the WebSocket or, if it isn't available
+    // or the data contains files, by ajax.
+    post: (data, {success, complete}) => {
+        const hasFiles = Array.from(data.values()).some(value => value instanceof File);
+        if (!CBA.socket || CBA.socket.readyState !== WebSocket.OPEN || hasFiles) {
+            $.ajax({
+                url: '',
+                type: 'POST',
+                data,
+                processData: false,
+                contentType: false,
+                success,
+                complete,
+            });
+            return;
+        }
+
+        const payload = {};
+        for (const [key, value] of data.entries()) {
+            (payload[key] = payload[key] || []).push(value);
+        }
+
+        CBA.socketId += 1;
+        const id = CBA.socketId;
+        CBA.socketRequests.set(id, {success, complete});
+        CBA.socket.send(JSON.stringify({id, data: payload}));
+    },
+
+    // Adds the key of the tab, which identifies its history on the server,
+    // and the sequence number of the request.
+    appendTab: (data, sequence = true) => {
+        const tab = $('meta[name=cba-tab]').attr('content');
+        if (tab) {
+            data.append('tab', tab);
+        }
+        if (sequence) {
+            CBA.sequence += 1;
+            data.append('sequence', CBA.sequence);
+        }
+    },
+
+    // Displays the passed history state. With full the server sends the
+    // complete HTML instead of patches.
+    reload: (state, full = false) => {
+        CBA.enqueue({send: done => {
+            const data = new FormData();
+            data.append('action', 'reload');
+            CBA.appendTab(data);
+            data.append('state', state);
+            if (full) {
+                data.append('full', 'true');
+            }
+            data.append('csrfmiddlewaretoken', $('input[name=csrfmiddlewaretoken]').attr('value'));
+
+            CBA.post(data, {
+                success: result => {
+                    CBA.handleResult(result);
+                },
+                complete: done,
+            });
+        }});
+    },
+
+    // True while a poll request for results of background work is open.
+    polling: false,
+
+    // Waits for results of background work of the tab (long polling) and
+    // lets the server apply them. Polling stops when no work is pending.
+    subscribe: () => {
+        if (CBA.polling) {
+            return;
+        }
+        CBA.polling = true;
+
+        const data = new FormData();
+        data.append('action', 'poll');
+        CBA.appendTab(data, false);
+        data.append('csrfmiddlewaretoken', $('input[name=csrfmiddlewaretoken]').attr('value'));
+
+        // Always by ajax, as the poll request waits on the server.
         $.ajax({
             url: '',
             type: 'POST',
@@ -112,22 +654,91 @@ const CBA = {
             processData: false,
             contentType: false,
             success: result => {
-                if (createState) {
-                    history.pushState(state, null, `#${state}`);
+                CBA.polling = false;
+                if (result.ready) {
+                    CBA.enqueue({send: done => {
+                        const data = new FormData();
+                        data.append('action', 'push');
+                        CBA.appendTab(data);
+                        data.append('csrfmiddlewaretoken', $('input[name=csrfmiddlewaretoken]').attr('value'));
+
+                        CBA.post(data, {
+                            success: result => {
+                                CBA.handleResult(result);
+                            },
+                            complete: done,
+                        });
+                    }});
+                } else if (result.pending) {
+                    CBA.subscribe();
                 }
-                CBA.replaceHTML(result.html);
-                CBA.addMessages(result.messages);
             },
+            error: () => {
+                CBA.polling = false;
+            },
+        });
+    },
+
+    defaultAjaxAction: (element, event, handler, createState, options = {}, complete = undefined) => {
+        let sourceId = null;
+        try {
+            sourceId = event.originalEvent.dataTransfer.getData('text');
+        } catch (e) {}
+
+        const elementId = element.attr('id');
+        const componentId = element.attr('cid') || elementId;
+
+        // Waiting events of the same kind, element and handler are merged.
+        let key = null;
+        if (options.latest || CBA.coalescedEvents.includes(event.type)) {
+            key = CBA.getEventKey(element, event, handler);
+        }
+
+        // The inputs and the state are collected when the request is sent,
+        // as former requests of the queue may change them.
+        CBA.enqueue({
+            event: {
+                handler,
+                element_id: elementId,
+                component_id: componentId,
+                component_value: element.attr('component_value') || componentId,
+                source_id: sourceId,
+                key_code: event.keyCode,
+            },
+            key,
+            abort: Boolean(options.latest),
+            createState,
+            options,
+            complete,
         });
     },
 
+    // Returns the key of an event of an element and handler or null.
+    getEventKey: (element, event, handler) => {
+        const elementId = element.attr('id');
+        return elementId ? `${event.type}:${elementId}:${handler}` : null;
+    },
+
     defaultJSAction: (element, event, handler) => {
         const fn = window[handler];
         fn(element);
     },
 
-    handleEvent: (element, event) => {
+    // Parses the options of a handler, e.g. "inputs=name,email;debounce=300;latest"
+    parseOptions: parts => {
+        const options = {};
+        for (const part of parts) {
+            const [key, ...value] = part.split('=');
+            options[key.trim()] = value.length ? value.join('=') : true;
+        }
+        return options;
+    },
+
+    handleEvent: (element, event, complete = undefined) => {
         const handlerString = element.attr(`${event.type}_handler`);
+        if (!handlerString) {
+            return;
+        }
         const handlerState = handlerString.split('|');
 
         let createState = false;
@@ -135,7 +746,9 @@ const CBA = {
             createState = true;
         }
 
-        const handler = handlerState[0].split(':');
+        const [handlerSpec, ...optionParts] = handlerState[0].split(';');
+        const options = CBA.parseOptions(optionParts);
+        const handler = handlerSpec.split(':');
 
         if (event.type === 'keyup') {
             if (handler[2]) {
@@ -153,7 +766,9 @@ const CBA = {
         }
 
         if (handler[0] === 'server') {
-            CBA.defaultAjaxAction(element, event, handler[1], createState);
+            CBA.schedule(CBA.getEventKey(element, event, handler[1]), options, () => {
+                CBA.defaultAjaxAction(element, event, handler[1], createState, options, complete);
+            });
         } else if (handler[0] === 'client') {
             CBA.defaultJSAction(element, event, handler[1], createState);
         }
@@ -164,6 +779,11 @@ const CBA = {
 
 // Register Events
 $(() => {
+    // Tracks changed inputs, which are sent with the next request.
+    $('body').on('input change', 'input.component, textarea.component, select', function(event) {
+        CBA.inputChanged($(this));
+    });
+
     $('body').on('click', '.click', function(event) {
         CBA.handleEvent($(this), event);
         return false;
@@ -195,6 +815,14 @@ $(() => {
         return false;
     });
 
+    CBA.connectSocket();
+
+    // Table Component: loads the next rows of scrolling tables.
+    $(window).on('scroll resize', () => {
+        CBA.scrollTables();
+    });
+    CBA.scrollTables();
+
     // DnD: Stores id of the draggable component for later use
     $('body').on('dragstart', '.draggable', function(event) {
         event.originalEvent.dataTransfer.setData('text', event.target.id);
@@ -225,19 +853,6 @@ $(() => {
 
     // Handles history changes
     window.addEventListener('popstate', function(e) {
-        const data = new FormData();
-        data.append('action', 'reload');
-        data.append('state', e.state);
-
-        $.ajax({
-            url: '',
-            type: 'POST',
-            data,
-            processData: false,
-            contentType: false,
-            success: result => {
-                CBA.replaceHTML(result.html);
-            },
-        });
+        CBA.reload(e.state || 0);
     });
 });
@@ -0,0 +1,324 @@
+import errno
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+_tree_store = None
+
+
+class TreeStore(object):
+    """Base class of tree stores, which store the histories of component
+    trees (``cba.history.History``) by key.
+
+    The histories are pickled, hence changes of a loaded history are only
+    stored by ``save``.
+    """
+    def load(self, key):
+        """Returns the history with the passed key or ``None``.
+        """
+        raise NotImplementedError
+
+    def save(self, key, history, version=None):
+        """Stores the passed history. Returns True if it has been stored.
+
+        version
+            The version of the history when it has been loaded. If given, the
+            history is only stored if the stored history has still this
+            version, i.e. no other request has stored it meanwhile (compare
+            and swap). Otherwise False is returned.
+        """
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear_expired(self):
+        """Deletes expired histories. Stores which expire histories on their
+        own needn't implement it.
+        """
+
+
+class LocalTreeStore(TreeStore):
+    """Stores the histories in process. The least recently used histories are
+    evicted if there are more than ``max_entries``.
+    """
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._histories = OrderedDict()
+        self._lock = Lock()
+
+    def load(self, key):
+        with self._lock:
+            entry = self._histories.pop(key, None)
+            if entry is None:
+                return None
+            self._histories[key] = entry
+        return pickle.loads(entry[1])
+
+    def save(self, key, history, version=None):
+        data = pickle.dumps(history, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            entry = self._histories.pop(key, None)
+            if entry is not None and version is not None and entry[0] != version:
+                self._histories[key] = entry
+                return False
+            self._histories[key] = (history.version, data)
+            while len(self._histories) > self.max_entries:
+                self._histories.popitem(last=False)
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            self._histories.pop(key, None)
+
+
+class FileTreeStore(TreeStore):
+    """Stores the histories as files.
+
+        directory
+            The directory of the files. Defaults to the setting
+            ``CBA_TREE_STORE_DIR`` or ``cba`` within the temporary directory.
+
+        timeout
+            The amount of seconds after which a history, which has not been
+            saved, is expired. Defaults to ``SESSION_COOKIE_AGE``.
+
+    Expired files are deleted by ``clear_expired``, which is called by
+    ``save`` at most every ``clear_interval`` seconds and by the management
+    command ``clearhistories``.
+
+    The files start with the version of the history. Conditional saves
+    compare it while they hold the lock file ``.lock`` of the directory.
+    """
+    clear_interval = 3600
+
+    def __init__(self, directory=None, timeout=None):
+        self.directory = directory or getattr(
+            settings, "CBA_TREE_STORE_DIR", os.path.join(tempfile.gettempdir(), "cba"))
+        self.timeout = timeout or getattr(settings, "SESSION_COOKIE_AGE", None)
+        self._cleared = time.time()
+        self._lock = Lock()
+
+    def load(self, key):
+        path = self._get_path(key)
+        try:
+            with open(path, "rb") as f:
+                if self.timeout and time.time() - os.fstat(f.fileno()).st_mtime > self.timeout:
+                    return None
+                pickle.load(f)
+                return pickle.load(f)
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+
+    def save(self, key, history, version=None):
+        try:
+            os.makedirs(self.directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        # Written to a temporary file first, which replaces the former file
+        # atomically.
+        fd, path = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(history.version, f, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(history, f, pickle.HIGHEST_PROTOCOL)
+            if version is None:
+                os.rename(path, self._get_path(key))
+            else:
+                with self._locked():
+                    stored = self._get_version(key)
+                    if stored is not None and stored != version:
+                        os.remove(path)
+                        return False
+                    os.rename(path, self._get_path(key))
+        except Exception:
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+
+        if time.time() - self._cleared > self.clear_interval:
+            self.clear_expired()
+        return True
+
+    def delete(self, key):
+        try:
+            os.remove(self._get_path(key))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def clear_expired(self):
+        self._cleared = time.time()
+        if not self.timeout:
+            return
+
+        try:
+            names = os.listdir(self.directory)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return
+            raise
+
+        for name in names:
+            if not name.endswith(".history"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if self._cleared - os.path.getmtime(path) > self.timeout:
+                    os.remove(path)
+            except OSError as e:
+                # Saved or deleted meanwhile
+                if e.errno != errno.ENOENT:
+                    raise
+
+    def _get_path(self, key):
+        return os.path.join(self.directory, "{}.history".format(key))
+
+    def _get_version(self, key):
+        """Returns the version of the stored history or ``None``.
+        """
+        try:
+            with open(self._get_path(key), "rb") as f:
+                return pickle.load(f)
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+
+    @contextmanager
+    def _locked(self):
+        """Locks the directory for other threads and, if possible, other
+        processes.
+        """
+        with self._lock:
+            with open(os.path.join(self.directory, ".lock"), "a") as f:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                yield
+
+
+class CacheTreeStore(TreeStore):
+    """Stores the histories within Django's cache.
+
+        cache
+            The alias of the cache. Defaults to the setting
+            ``CBA_HISTORY_CACHE`` or ``default``.
+
+        timeout
+            The timeout of the histories. Defaults to ``SESSION_COOKIE_AGE``.
+
+    The cache must be shared by all processes which handle requests, as the
+    requests of a tab can be handled by any of them (see
+    ``check_shared_cache``).
+    """
+    # The maximal amount of seconds a conditional save waits for or holds
+    # the lock of a history.
+    lock_timeout = 10
+
+    def __init__(self, cache=None, timeout=None):
+        alias = cache or getattr(settings, "CBA_HISTORY_CACHE", "default")
+        check_shared_cache(alias, "CBA_HISTORY_CACHE")
+        self.cache = caches[alias]
+        self.timeout = timeout or getattr(settings, "SESSION_COOKIE_AGE", None)
+
+    def load(self, key):
+        return self.cache.get(self._get_key(key))
+
+    def save(self, key, history, version=None):
+        values = {
+            self._get_key(key): history,
+            self._get_key(key, "version"): history.version,
+        }
+        if version is None:
+            self.cache.set_many(values, self.timeout)
+            return True
+
+        # The cache has no compare and swap, hence the version is compared
+        # while a lock entry is held.
+        lock = self._get_key(key, "lock")
+        end = time.time() + self.lock_timeout
+        while not self.cache.add(lock, True, self.lock_timeout):
+            if time.time() >= end:
+                return False
+            time.sleep(0.01)
+
+        try:
+            stored = self.cache.get(self._get_key(key, "version"))
+            if stored is not None and stored != version:
+                return False
+            self.cache.set_many(values, self.timeout)
+        finally:
+            self.cache.delete(lock)
+        return True
+
+    def delete(self, key):
+        self.cache.delete_many([self._get_key(key), self._get_key(key, "version")])
+
+    def _get_key(self, key, name=None):
+        if name is None:
+            return "cba-history-{}".format(key)
+        return "cba-history-{}-{}".format(key, name)
+
+
+def check_shared_cache(alias, setting):
+    """Raises ``ImproperlyConfigured`` if the cache with the passed alias is
+    not shared between processes, e.g. Django's default local memory cache,
+    unless the setting ``CBA_LOCAL_CACHE`` (defaults to ``DEBUG``) is True,
+    i.e. the application runs in one process. A dummy cache, which doesn't
+    store anything, is never accepted.
+
+        setting
+            The name of the setting which selects the cache, for the message.
+    """
+    cache = caches[alias]
+    if isinstance(cache, DummyCache):
+        raise ImproperlyConfigured(
+            "The cache '{}' doesn't store anything. Set {} to another cache.".format(alias, setting))
+
+    if isinstance(cache, LocMemCache) and not getattr(settings, "CBA_LOCAL_CACHE", settings.DEBUG):
+        raise ImproperlyConfigured(
+            "The cache '{}' is not shared between processes. Set {} to a shared cache (e.g. "
+            "memcached, redis or the database) or CBA_LOCAL_CACHE to True if the application "
+            "runs in one process.".format(alias, setting))
+
+
+def get_tree_store():
+    """Returns the tree store. The class of the store is given by the setting
+    ``CBA_TREE_STORE`` (a dotted path). Defaults to ``CacheTreeStore``.
+    """
+    global _tree_store
+    if _tree_store is None:
+        path = getattr(settings, "CBA_TREE_STORE", "cba.stores.CacheTreeStore")
+        _tree_store = import_string(path)()
+    return _tree_store
+
+
+def set_tree_store(store):
+    """Sets the tree store, e.g. a custom ``TreeStore``.
+    """
+    global _tree_store
+    _tree_store = store
@@ -1,4 +1,41 @@
+import gzip
+import io
+import json
+import os
+import pickle
+import time
+from threading import Thread
+
+import pytest
+from django.contrib.auth.models import Group as AuthGroup
+from django.contrib.sessions.backends.cache import SessionStore
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection
+from django.template.loader import render_to_string
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.test.utils import override_settings
+from django.utils.html import escape
+from django.utils.translation import ugettext_lazy
+
+import cba
+from cba import ContextLocal
+from cba import base
 from cba import components
+from cba import patch
+from cba import rendering
+from cba import utils
+from cba.history import History
+from cba.history import HistoryStore
+from cba.history import Journal
+from cba.layouts import Grid
+from cba.push import Mailbox
+from cba.rendering import collapse_whitespace
+from cba.stores import CacheTreeStore
+from cba.stores import FileTreeStore
+from cba.stores import LocalTreeStore
+from cba.stores import set_tree_store
 
 
 def test_hidden_input():
@@ -51,3 +88,1170 @@ def test_button_render():
         </button>
     """
     assert "".join(html.split()) == "".join(expected_html.split())
+
+
+def _create_tree(amount=10):
+    return components.Group(id="root", initial_components=[
+        components.TextInput(id="input-{}".format(i)) for i in range(amount)
+    ] + [
+        Grid(id="grid", initial_components=[components.HTML(id="html-1")]),
+    ])
+
+
+def test_history_create_state():
+    root = _create_tree()
+    history = History(root)
+
+    with Journal() as journal:
+        root.get_component("input-1").value = "Hello"
+    history.commit(journal, 0, create_state=True)
+
+    # Only the changed component has been recorded
+    assert len(journal) == 1
+
+    assert history.checkout(0).get_component("input-1").value == ""
+    assert history.checkout(1).get_component("input-1").value == "Hello"
+
+
+def test_history_add_and_remove_components():
+    root = _create_tree()
+    history = History(root)
+
+    with Journal() as journal:
+        grid = root.get_component("grid")
+        grid.remove_component("html-1")
+        grid.add_component(components.HTML(id="html-2"))
+    history.commit(journal, 0, create_state=True)
+
+    assert [c.id for c in history.checkout(0).get_component("grid").components] == ["html-1"]
+    assert [c.id for c in history.checkout(1).get_component("grid").components] == ["html-2"]
+
+    # The new component has been removed from the former state only
+    assert history.checkout(0).get_component("html-2") is None
+    assert history.checkout(1).get_component("html-2").parent.id == "grid"
+
+
+def test_history_change_state_in_place():
+    root = _create_tree()
+    history = History(root)
+
+    with Journal() as journal:
+        root.get_component("input-1").value = "1"
+    history.commit(journal, 0, create_state=True)
+
+    with Journal() as journal:
+        root.get_component("input-2").value = "2"
+    history.commit(journal, 1, create_state=True)
+
+    # Change state 1 without creating a new one, which must not leak into
+    # the neighbouring states.
+    root = history.checkout(1)
+    with Journal() as journal:
+        root.get_component("input-3").value = "3"
+    history.commit(journal, 1)
+
+    root = history.checkout(0)
+    assert [root.get_component("input-{}".format(i)).value for i in (1, 2, 3)] == ["", "", ""]
+    root = history.checkout(2)
+    assert [root.get_component("input-{}".format(i)).value for i in (1, 2, 3)] == ["1", "2", ""]
+    root = history.checkout(1)
+    assert [root.get_component("input-{}".format(i)).value for i in (1, 2, 3)] == ["1", "", "3"]
+
+
+class _Root(components.Group):
+    def init_components(self):
+        self.initial_components = [
+            components.TextInput(id="name"),
+            components.HTML(id="output"),
+        ]
+
+    @base.event_handler
+    def handle_save(self):
+        output = self.get_component("output")
+        output.content = self.get_component("name").value
+        output.refresh()
+
+
+class _View(base.CBAView):
+    root = _Root
+
+
+def _request(session, data=None):
+    if data is None:
+        request = RequestFactory().get("/")
+    else:
+        request = RequestFactory().post("/", data)
+    request.session = session
+    cba.set_request(request)
+    return request
+
+
+def _post(view, session, data):
+    """Posts the passed data to the view and returns the JSON response."""
+    return json.loads(view.as_view()(_request(session, data)).content)
+
+
+def _load(session, tab=None):
+    """Returns the history of the tab of the session."""
+    return HistoryStore(_request(session)).load(tab)
+
+
+def test_view_history(session):
+    _View.as_view()(_request(session))
+
+    html = _post(_View, session, {
+        "handler": "handle_save", "component_id": "output", "name": "Jane",
+        "state": "1", "create_state": "true",
+    })["html"]
+    assert html[0][0] == "#output"
+    assert "Jane" in html[0][1]
+
+    html = _post(_View, session, {"action": "reload", "state": "0"})["html"]
+    assert "Jane" not in html[0][1]
+    history = _load(session)
+    assert history.checkout(1).get_component("output").content == "Jane"
+
+
+def test_history_evicts_least_recently_used_states():
+    root = _create_tree()
+    history = History(root, max_depth=3)
+
+    for state in range(4):
+        with Journal() as journal:
+            root.get_component("input-1").value = str(state)
+        history.commit(journal, state, create_state=True)
+
+    assert history.states == [2, 3, 4]
+
+    # Using state 2 makes state 3 the least recently used one. The deltas of
+    # state 2 and 3 are merged.
+    history.checkout(2)
+    root = history.checkout(4)
+    with Journal() as journal:
+        root.get_component("input-2").value = "x"
+    history.commit(journal, 4)
+
+    assert history.states == [2, 3, 4]
+    history.max_depth = 2
+    history._evict()
+    assert history.states == [2, 4]
+    assert history.checkout(2).get_component("input-1").value == "1"
+    assert history.checkout(2).get_component("input-2").value == ""
+    assert history.checkout(4).get_component("input-1").value == "3"
+    assert history.checkout(4).get_component("input-2").value == "x"
+
+
+def test_history_max_bytes():
+    root = _create_tree(100)
+    history = History(root, max_bytes=2000)
+
+    for state in range(20):
+        with Journal() as journal:
+            for i in range(10):
+                root.get_component("input-{}".format(i)).value = str(state)
+        history.commit(journal, state, create_state=True)
+
+    assert 0 < history.size <= 2000
+    assert 0 not in history
+    assert history.checkout(20).get_component("input-1").value == "19"
+
+
+def test_view_reload_evicted_state(session):
+    _View.as_view()(_request(session))
+
+    response = _post(_View, session, {"action": "reload", "state": "7"})
+    result = response
+    assert result["state"] == 0
+    assert result["html"][0][0] == "#root"
+
+
+def test_component_index():
+    root = _create_tree()
+    grid = root.get_component("grid")
+    assert root._index["html-1"] is grid.get_component("html-1")
+
+    group = components.Group(id="group", initial_components=[components.HTML(id="html-2")])
+    grid.add_component(group)
+    assert root.get_component("html-2").parent is group
+    assert grid.get_component("input-1", with_root=False) is None
+    assert grid.get_component("input-1").id == "input-1"
+
+    grid.replace_component("html-2", components.Button(id="button-1"))
+    assert root.get_component("html-2") is None
+    assert root.get_component("button-1").parent is group
+
+    group.clear()
+    assert root.get_component("button-1") is None
+    assert sorted(root._index) == sorted(
+        ["input-{}".format(i) for i in range(10)] + ["grid", "html-1", "group"])
+
+    grid.remove_component("group")
+    assert root.get_component("group") is None
+
+
+def test_component_duplicate_id():
+    root = _create_tree()
+    with pytest.raises(ValueError):
+        root.get_component("grid").add_component(components.HTML(id="input-1"))
+
+    with pytest.raises(ValueError):
+        components.Group(initial_components=[
+            components.HTML(id="html"),
+            components.Group(initial_components=[components.HTML(id="html")]),
+        ])
+
+
+def test_view_collects_refreshed_components():
+    root = _create_tree()
+    root.get_component("html-1").refresh()
+    root.get_component("input-1").refresh()
+    root.get_component("grid").refresh()
+    root.get_component("input-2").refresh()
+    root.remove_component("input-2")
+    root.add_message("Saved")
+
+    view = base.CBAView()
+    view._collect_components_data(root)
+
+    # html-1 is part of the refreshed grid, input-2 has been removed.
+    assert [html[0] for html in view._html] == ["#input-1", "#grid"]
+    assert view._messages == [{"text": "Saved", "type": "info"}]
+    assert root._dirty is None
+
+
+def test_view_load_changed_data(session):
+    _View.as_view()(_request(session))
+
+    _View.as_view()(_request(session, {
+        "handler": "handle_save", "component_id": "output", "name": "Jane",
+        "state": "1", "create_state": "false", "partial": "true",
+    }))
+    root = _load(session).root
+    assert root.get_component("name").value == "Jane"
+    assert root.get_component("output").content == "Jane"
+
+
+def _create_data_provider(amount=100):
+    data_provider = components.TableDataProvider()
+    data_provider.data = [
+        {"id": "row-{}".format(i), "data": ["Name {}".format(i), i]}
+        for i in range(amount)
+    ]
+    return data_provider
+
+
+def test_table_virtual():
+    table = components.Table(id="table", data_provider=_create_data_provider(), pagination=10, virtual=True)
+    table.load_data()
+    assert list(table.components) == []
+
+    html = table.render()
+    assert html.count("<tr ") == 10
+    assert 'id="row-9"' in html
+    assert 'id="row-10"' not in html
+    assert "Name 3" in html
+
+    row = table.get_row("row-3")
+    assert isinstance(row, components.TableRow)
+    assert table.get_component("row-3") is row
+    row.css_class = "marked"
+    assert "marked" in table.render()
+
+    table.set_page(2)
+    assert list(table.components) == []
+    assert 'id="row-10"' in table.render()
+
+
+def test_table_scroll():
+    table = components.Table(id="table", data_provider=_create_data_provider(25), scroll=10)
+    root = components.Group(id="root", initial_components=[table])
+    html = table.render()
+    assert html.count("<tr ") == 10
+    assert 'scroll_handler="server:handle_scroll"' in html
+    assert "pagination" not in html
+
+    table.component_value = "20"
+    table.handle_scroll()
+    view = base.CBAView()
+    view._collect_components_data(root)
+    assert view._html == []
+    assert view._append[0][0] == "#table > tbody"
+    assert view._append[0][1].count("<tr ") == 5
+    assert 'id="row-24"' in view._append[0][1]
+
+
+def test_table_queryset(db, session):
+    AuthGroup.objects.bulk_create(AuthGroup(name="Group {:02}".format(i)) for i in range(25))
+    _request(session)
+
+    data_provider = components.QuerySetDataProvider(AuthGroup.objects.order_by("-name"), ["name"])
+    assert data_provider.get_headers() == ["name"]
+
+    table = components.Table(id="table", data_provider=data_provider, pagination=10)
+    with CaptureQueriesContext(connection) as queries:
+        table.load_data()
+        html = table.render()
+    assert len(queries) == 2
+    assert "Group 24" in html
+    assert "Group 14" not in html
+
+    # The next page seeks for the last row and the count is cached.
+    with CaptureQueriesContext(connection) as queries:
+        table.set_page(2)
+        html = table.render()
+    assert len(queries) == 1
+    assert "OFFSET" not in queries[0]["sql"]
+    assert "Group 15" not in html
+    assert "Group 14" in html
+    assert "Group 05" in html
+    assert "Group 04" not in html
+
+    # Unknown positions fall back to an offset.
+    rows = components.QuerySetDataProvider(AuthGroup.objects.all(), ["name"]).get_rows(20, 30)
+    assert [row["data"] for row in rows] == [["Group {:02}".format(i)] for i in range(20, 25)]
+
+    row = data_provider.get_row(rows[0]["id"])
+    assert row["data"] == ["Group 20"]
+    assert data_provider.get_row("group-abc") is None
+
+
+def test_table_sort_and_filter(session):
+    data_provider = _create_data_provider(25)
+    table = components.Table(
+        id="table", headers=["Name", "Number"], data_provider=data_provider, pagination=10,
+        sortable=True, filterable=True)
+    table.load_data()
+
+    table.component_value = "1"
+    table.handle_sort()
+    table.handle_sort()
+    assert (table.order_by, table.reverse) == (1, True)
+    assert [row.id for row in table.components][:2] == ["row-24", "row-23"]
+    html = table.render()
+    assert "sorted descending" in html
+    assert 'id="table-filter-0"' in html
+
+    # The order of the column is computed once.
+    assert data_provider.get_rows(0, 1, order_by=1, reverse=True) == [data_provider.data[24]]
+    assert list(data_provider._get_cache()[0]) == [1]
+
+    _request(session, {"table-filter-0": "name 1"})
+    table.handle_filter()
+    assert table.filters == {0: "name 1"}
+    assert table.total_rows() == 11
+    assert [row.id for row in table.components][:2] == ["row-19", "row-18"]
+    assert 'value="name 1"' in table.render()
+
+    _request(session, {"table-filter-0": ""})
+    table.handle_filter()
+    assert table.filters == {}
+    assert table.total_rows() == 25
+
+
+def test_table_queryset_sort_and_filter(db, session):
+    AuthGroup.objects.bulk_create(AuthGroup(name="Group {:02}".format(i)) for i in range(25))
+    _request(session)
+
+    data_provider = components.QuerySetDataProvider(AuthGroup.objects.all(), ["name"])
+    first = data_provider.get_rows(0, 5, order_by=0, reverse=True, filters={0: "group 1"})
+    second = data_provider.get_rows(5, 10, order_by=0, reverse=True, filters={0: "group 1"})
+    assert [row["data"][0] for row in first + second] == ["Group {:02}".format(i) for i in range(19, 9, -1)]
+    assert data_provider.total_rows(filters={0: "group 1"}) == 10
+    assert data_provider.total_rows() == 25
+
+
+def test_render_nested_components():
+    table = components.Table(id="table", data_provider=_create_data_provider(20), pagination=10)
+    table.load_data()
+    root = components.Group(id="root", initial_components=[
+        components.TextInput(id="name", label="Name", value="<John>"),
+        components.Tab(id="tab", initial_components=[
+            components.TabItem(id="tab-1", title="Table", initial_components=[table]),
+        ]),
+    ])
+
+    # Nested components are rendered within the context of the root.
+    assert root.render() == collapse_whitespace(render_to_string(root.template, {"self": root}))
+    assert "&lt;John&gt;" in root.render()
+    assert root.render().count("<tr ") == 10
+
+
+def test_render_cache():
+    cache = rendering.LocalRenderCache(max_entries=2)
+    rendering.set_render_cache(cache)
+    try:
+        html = components.HTML(id="html", content="<b>Hello</b>")
+        html.render_cache = True
+        root = components.Group(id="root", initial_components=[html])
+
+        expected = root.render()
+        assert root.render() == expected
+        assert (cache.hits, cache.misses) == (1, 1)
+
+        html.content = "<b>Hi</b>"
+        assert "<b>Hi</b>" in root.render()
+        assert (cache.hits, cache.misses) == (1, 2)
+
+        # The least recently used fragment is evicted.
+        other = components.HTML(id="other", content="Other")
+        other.render_cache = True
+        other.render()
+        html.content = "<b>Hello</b>"
+        root.render()
+        assert (cache.hits, cache.misses) == (1, 4)
+    finally:
+        rendering.set_render_cache(None)
+
+
+def test_component_pickle():
+    root = _create_tree()
+    root.get_component("input-3").element_id = "input-3"
+    root.get_component("input-3").value = "Hello"
+
+    state = root.get_component("input-3").__getstate__()
+    assert "element_id" not in state
+    assert "disabled" not in state
+    assert state["value"] == "Hello"
+
+    root = pickle.loads(pickle.dumps(root, pickle.HIGHEST_PROTOCOL))
+    assert [component.id for component in root.components] == ["input-{}".format(i) for i in range(10)] + ["grid"]
+    assert root.get_component("html-1").parent.id == "grid"
+    component = root.get_component("input-3")
+    assert component.value == "Hello"
+    assert component.parent is root
+    assert component.displayed is True
+    assert component.attributes == {}
+    assert not hasattr(component, "element_id")
+    assert root._messages == []
+
+
+def test_view_tabs(session):
+    first = _View.as_view()(_request(session)).content
+    second = _View.as_view()(_request(session)).content
+    tabs = session[HistoryStore.session_key]
+    assert len(tabs) == 2
+    assert 'content="{}"'.format(tabs[0]) in first.decode("utf-8")
+    assert 'content="{}"'.format(tabs[1]) in second.decode("utf-8")
+
+    # Each tab has its own history.
+    _View.as_view()(_request(session, {
+        "handler": "handle_save", "component_id": "output", "name": "Jane",
+        "state": "1", "create_state": "true", "tab": tabs[0],
+    }))
+    assert _load(session, tabs[0]).root.get_component("output").content == "Jane"
+    assert _load(session, tabs[1]).root.get_component("output").content != "Jane"
+
+    # Unknown tabs have to be reloaded
+    response = _post(_View, session, {"action": "reload", "state": "0", "tab": "unknown"})
+    assert response == {"reload": True}
+
+
+def test_file_tree_store(tmpdir):
+    store = FileTreeStore(directory=str(tmpdir.join("histories")))
+    assert store.load("tab") is None
+
+    store.save("tab", History(_create_tree()))
+    history = store.load("tab")
+    assert history.root.get_component("input-3").parent is history.root
+
+    store.delete("tab")
+    assert store.load("tab") is None
+
+
+def test_view_outdated_requests(session):
+    _View.as_view()(_request(session))
+
+    data = {
+        "handler": "handle_save", "component_id": "output", "name": "Jane",
+        "state": "1", "create_state": "true", "sequence": "1",
+    }
+    _View.as_view()(_request(session, data))
+    assert _load(session).sequence == 1
+
+    # The same request again is dropped.
+    data["name"] = "John"
+    response = _post(_View, session, data)
+    assert response == {"outdated": True}
+    history = _load(session)
+    assert history.root.get_component("output").content == "Jane"
+    assert history.state == 1
+
+
+class _BatchRoot(_Root):
+    @base.event_handler
+    def handle_count(self):
+        output = self.get_component("output")
+        output.content += "+{}".format(self.component_value)
+        output.refresh()
+
+
+class _BatchView(base.CBAView):
+    root = _BatchRoot
+
+
+def test_view_batch(session):
+    _BatchView.as_view()(_request(session))
+    response = _post(_BatchView, session, {
+        "events": json.dumps([
+            {"handler": "handle_save", "component_id": "output"},
+            {"handler": "handle_count", "component_id": "output", "component_value": 1},
+            {"handler": "handle_count", "component_id": "output", "component_value": 2},
+        ]),
+        "name": "Jane", "state": "1", "create_state": "true", "partial": "true",
+    })
+
+    # The events are applied in sequence, the output is rendered once.
+    html = response["html"]
+    assert [id for id, content in html] == ["#output"]
+    assert "Jane+1+2" in html[0][1]
+
+    history = _load(session)
+    assert history.state == 1
+    assert history.root.get_component("output").content == "Jane+1+2"
+
+
+def test_event_handlers(session):
+    assert set(base.get_event_handlers(_BatchRoot)) == {"handle_save", "handle_count"}
+    assert "handle_pagination" in base.get_event_handlers(components.Table)
+
+    # Methods which are not registered can't be called.
+    _View.as_view()(_request(session))
+    with pytest.raises(AttributeError):
+        _View.as_view()(_request(session, {
+            "handler": "refresh_all", "component_id": "output", "state": "1", "create_state": "false",
+        }))
+
+
+def test_websocket(session):
+    pytest.importorskip("channels")
+    from asgiref.inmemory import ChannelLayer
+    from channels.exceptions import DenyConnection
+    from channels.message import Message
+    from cba import websocket
+
+    class _Consumer(websocket.CBAConsumer):
+        view = _View
+
+    _View.as_view()(_request(session))
+    session.save()
+    tab = session[HistoryStore.session_key][-1]
+
+    layer = ChannelLayer()
+    cookie = [b"cookie", "sessionid={}".format(session.session_key).encode("utf-8")]
+    headers = [cookie, [b"origin", b"http://testserver"]]
+
+    def send(channel, content):
+        content.update({"reply_channel": u"websocket.send.test", "path": "/ws/", "headers": headers})
+        _Consumer(Message(content, channel, layer))
+        return layer.receive([u"websocket.send.test"])[1]
+
+    def send_event(data):
+        result = send("websocket.receive", {"text": json.dumps({"id": 1, "data": data})})
+        return json.loads(result["text"])
+
+    with override_settings(ALLOWED_HOSTS=["testserver"]):
+        assert send("websocket.connect", {}) == {"accept": True}
+
+        # Other sites can't connect with the cookie of the user.
+        headers = [cookie, [b"origin", b"http://evil.example"]]
+        with pytest.raises(DenyConnection):
+            send("websocket.connect", {})
+        headers = [cookie]
+        with pytest.raises(DenyConnection):
+            send("websocket.connect", {})
+
+    data = {
+        "handler": ["handle_save"], "component_id": ["output"], "name": ["Jane"],
+        "state": ["1"], "create_state": ["true"], "partial": ["true"],
+    }
+    assert send_event(data)["result"] == {"reload": True}
+
+    data["tab"] = [tab]
+    result = send_event(data)
+    assert result["id"] == 1
+    assert "Jane" in result["result"]["html"][0][1]
+
+    # The history is saved with every message, hence ajax requests of the
+    # tab continue with it.
+    assert _load(session).state == 1
+    response = _View.as_view()(_request(session, {
+        "handler": "handle_save", "component_id": "output", "name": "John",
+        "state": "2", "create_state": "true", "partial": "true",
+    }))
+    assert "John" in response.content.decode("utf-8")
+
+    send("websocket.disconnect", {})
+    history = _load(session)
+    assert history.state == 2
+    assert history.root.get_component("output").content == "John"
+
+
+def _greet(name):
+    return "Hello {}".format(name)
+
+
+class _PushRoot(_Root):
+    @base.event_handler
+    def handle_greet(self):
+        self.run_in_background(_greet, "show_greeting", args=(self.get_component("name").value,))
+
+    def show_greeting(self, greeting):
+        output = self.get_component("output")
+        output.content = greeting
+        output.refresh()
+
+
+class _PushView(base.CBAView):
+    root = _PushRoot
+
+
+def test_view_push(session):
+    _PushView.as_view()(_request(session))
+    tab = session[HistoryStore.session_key][-1]
+
+    response = _post(_PushView, session, {
+        "handler": "handle_greet", "component_id": "output", "name": "Jane",
+        "state": "1", "create_state": "true", "tab": tab,
+    })
+    assert response["push"] is True
+
+    response = _post(_PushView, session, {"action": "poll", "tab": tab})
+    assert response == {"ready": True, "pending": 1}
+
+    # The result is applied to the current state.
+    response = _post(_PushView, session, {"action": "push", "tab": tab})
+    result = response
+    assert "Hello Jane" in result["html"][0][1]
+    assert "push" not in result
+
+    history = _load(session, tab)
+    assert history.state == 1
+    assert history.root.get_component("output").content == "Hello Jane"
+
+
+def test_context_local():
+    value = ContextLocal("test")
+    value.set("main")
+
+    # Other threads don't see the value.
+    seen = []
+    thread = Thread(target=lambda: seen.append(value.get()))
+    thread.start()
+    thread.join()
+    assert seen == [None]
+    assert value.get() == "main"
+
+
+def test_patch():
+    old = u'<div class="render" id="g"><p>One</p><ul><li id="a">A</li><li id="b">B</li></ul></div>'
+    new = u'<div class="render x" id="g"><p>Two</p><ul><li id="b">B</li><li id="c">C</li></ul></div>'
+    assert patch.diff(old, new) == [
+        ["attr", None, [], "div", "class", "render x"],
+        ["html", None, [0], "p", "Two"],
+        ["remove", "a", [], "li"],
+        ["insert", None, [1], "ul", 1, '<li id="c">C</li>'],
+    ]
+
+    # Changed scripts around the render element need a replacement.
+    assert patch.diff(old, new + u"<script>f()</script>") is None
+
+
+def test_patch_scripts():
+    # Changed elements with inline scripts are replaced, hence the scripts
+    # run again, e.g. to update the dropdown of a select.
+    select = components.Select(id="select", options=[{"value": "a", "name": "A"}, {"value": "b", "name": "B"}])
+    old = select.render()
+    select.value = "b"
+    assert patch.diff(old, select.render()) is None
+    assert patch.diff(old, old) == []
+
+    group = components.Group(id="group", initial_components=[select, components.HTML(id="html")])
+    old = group.render()
+    select.value = "a"
+    ops = patch.diff(old, group.render())
+    assert [op[0] for op in ops] == ["replace"]
+    assert "<script" in ops[0][4]
+
+
+def test_view_patch_responses(session):
+    _View.as_view()(_request(session))
+
+    data = {"handler": "handle_save", "component_id": "output", "state": "1", "partial": "true"}
+    for name in ("Jane", "John"):
+        data["name"] = name
+        response = _post(_View, session, data)
+
+    # The second response only patches the content.
+    assert response["html"] == []
+    assert response["patches"] == [["#output", [["html", "output", [], "div", "John"]]]]
+
+
+class _ClearRoot(_Root):
+    @base.event_handler
+    def handle_clear(self):
+        name = self.get_component("name")
+        name.value = ""
+        name.refresh()
+
+
+class _ClearView(base.CBAView):
+    root = _ClearRoot
+
+
+def test_view_patch_responses_browser_values(session):
+    _ClearView.as_view()(_request(session))
+    data = {"handler": "handle_clear", "component_id": "name", "state": "1", "partial": "true"}
+    for name in ("", "Alice"):
+        data["name"] = name
+        response = _post(_ClearView, session, data)
+
+    # The browser displays the typed value, hence the cleared value is sent,
+    # although the sent HTML hasn't changed.
+    assert response["html"][0][0] == "#name"
+    assert 'value=""' in response["html"][0][1]
+
+
+class _UpdateRoot(_Root):
+    @base.event_handler
+    def handle_check(self):
+        name = self.get_component("name")
+        name.error = "Required"
+        name.css_class = "wide"
+        self.get_component("output").displayed = False
+
+
+class _UpdateView(base.CBAView):
+    root = _UpdateRoot
+
+
+def test_view_reactive_attributes(session):
+    _UpdateView.as_view()(_request(session))
+    response = _post(_UpdateView, session, {
+        "handler": "handle_check", "component_id": "output", "name": "Jane", "state": "1", "partial": "true",
+    })
+
+    # Nothing is rendered, the value from the browser isn't sent back. The
+    # css class of text inputs isn't rendered, hence it isn't updated either.
+    assert response["html"] == []
+    assert response["updates"] == [
+        ["name", {"error": "Required"}],
+        ["output", {"displayed": False}],
+    ]
+
+
+def test_collapse_whitespace():
+    html = u'<div class="a\n  b">\n  <b>x</b>  </div><pre> 1\n  2</pre>\n<script>// c\nf()</script>'
+    assert collapse_whitespace(html) == u'<div class="a\n  b"> <b>x</b> </div><pre> 1\n  2</pre> <script>// c\nf()</script>'
+
+
+def test_collapse_whitespace_attribute_values():
+    html = components.TextInput(id="name", value="John  Smith\nJr").render()
+    assert 'value="John  Smith\nJr"' in html
+
+    data = json.dumps({"a": "1 >  2", "b": "x\n  y"}, indent=2)
+    html = components.HiddenInput(id="data", value=data).render()
+    assert 'value="{}"'.format(escape(data)) in html
+
+    # Unescaped ">" within attribute values doesn't end the tag.
+    html = u'<a title="1 >  2" data-x=\'a\n  b\'>\n  x</a>'
+    assert collapse_whitespace(html) == u'<a title="1 >  2" data-x=\'a\n  b\'> x</a>'
+
+
+class _CompactView(base.CBAView):
+    root = _Root
+    compact_responses = True
+    compress_min_bytes = 1
+
+
+def test_view_compact_compressed_responses(session):
+    _CompactView.as_view()(_request(session))
+    request = _request(session, {
+        "handler": "handle_save", "component_id": "output", "name": "Jane", "state": "1", "partial": "true",
+    })
+    request.META["HTTP_ACCEPT_ENCODING"] = "gzip, deflate"
+    response = _CompactView.as_view()(request)
+
+    assert response["Content-Encoding"] == "gzip"
+    result = json.loads(gzip.GzipFile(fileobj=io.BytesIO(response.content)).read().decode("utf-8"))
+    assert result["h"][0] == "output"
+    assert "Jane" in result["h"][1]
+    assert "html" not in result
+
+
+class _UJSON(object):
+    """Encodes like ujson, which encodes unknown iterables as lists."""
+    @staticmethod
+    def dumps(data):
+        return json.dumps(data, default=list)
+
+
+def test_dumps_lazy_strings(monkeypatch):
+    data = {"messages": [{"text": ugettext_lazy("Saved"), "type": "info"}]}
+    for fast_json in (None, _UJSON):
+        monkeypatch.setattr(utils, "fast_json", fast_json)
+        assert json.loads(utils.dumps(data)) == {"messages": [{"text": "Saved", "type": "info"}]}
+
+    # Unknown values raise rather than recurse.
+    monkeypatch.setattr(utils, "fast_json", None)
+    with pytest.raises(TypeError):
+        utils.dumps({"value": object()})
+
+
+class _LazyTabItem(components.TabItem):
+    lazy = True
+
+    def init_components(self):
+        self.initial_components = [
+            components.HTML(id="{}-content".format(self.id), content="Lazy"),
+            components.TextInput(id="{}-name".format(self.id)),
+        ]
+
+    @base.event_handler
+    def handle_change(self):
+        content = self.get_component("{}-content".format(self.id))
+        content.content = "Changed"
+        content.refresh()
+
+    @base.event_handler
+    def handle_grid(self):
+        self.is_grid = True
+
+    @base.event_handler
+    def handle_change_item(self):
+        self.get_component("{}-content".format(self.id)).content = "Changed"
+        self.refresh()
+
+
+class _LazyRoot(components.Group):
+    def init_components(self):
+        self.initial_components = [
+            components.Tab(id="tab", initial_components=[
+                _LazyTabItem(id="tab-1", title="One", active=True),
+                _LazyTabItem(id="tab-2", title="Two"),
+            ]),
+        ]
+
+    @base.event_handler
+    def handle_change_tab(self):
+        self.get_component("tab-1").get_component("tab-1-content").content = "Changed"
+        self.get_component("tab").refresh()
+
+
+class _LazyView(base.CBAView):
+    root = _LazyRoot
+
+
+def test_lazy_components():
+    root = _LazyRoot(id="root")
+    assert root.get_component("tab-2")._pending
+
+    # Hidden lazy components are rendered as placeholder.
+    html = root.render()
+    assert "tab-1-content" in html
+    assert "tab-2-content" not in html
+    assert "tab-2-content" not in root._index
+
+    # Misses don't initialize lazy components, lookups through them do.
+    assert root.get_component("tab-2-content") is None
+    assert root.get_component("unknown") is None
+    assert root.get_component("tab-2")._pending
+    assert root.get_component("tab-2").get_component("tab-2-content").content == "Lazy"
+    assert not root.get_component("tab-2")._pending
+    assert root.get_component("tab-2-content") is not None
+
+
+def test_view_lazy_tab_item(session):
+    _LazyView.as_view()(_request(session))
+    response = _post(_LazyView, session, {
+        "handler": "handle_activate", "component_id": "tab-2", "state": "1", "partial": "true",
+    })
+    assert response["html"][0][0] == "#tab-2"
+    assert "tab-2-content" in response["html"][0][1]
+
+    root = _load(session).root
+    assert [item.active for item in root.get_component("tab").components] == [False, True]
+
+
+def test_view_lazy_tab_item_reactivate(session):
+    _LazyView.as_view()(_request(session))
+
+    def activate(component_id, component_value):
+        return _post(_LazyView, session, {
+            "handler": "handle_activate", "component_id": component_id, "component_value": component_value,
+            "state": "1", "partial": "true",
+        })
+
+    activate("tab-2", "tab-2")
+
+    # The browser displays the loaded body, the server only records the
+    # activation.
+    assert activate("tab-1", "loaded")["html"] == []
+    root = _load(session).root
+    assert [item.active for item in root.get_component("tab").components] == [True, False]
+
+    # A refresh of the tab renders the active tab item.
+    response = _post(_LazyView, session, {
+        "handler": "handle_change_tab", "component_id": "tab", "state": "1", "partial": "true",
+    })
+    html = response["html"][0][1]
+    assert 'id="tab-1-content"' in html
+    assert 'id="tab-2-content"' not in html
+    assert 'load_handler="server:handle_activate"' in html
+
+
+def test_view_lazy_tab_item_cache(session, render_cache):
+    _LazyView.as_view()(_request(session))
+
+    def post(handler, component_id, **data):
+        data.update({"handler": handler, "component_id": component_id, "state": "1", "partial": "true"})
+        return _post(_LazyView, session, data)
+
+    def body_key():
+        return _load(session).root.get_component("tab-2").body_key
+
+    post("handle_activate", "tab-2")
+    post("handle_activate", "tab-1")
+    misses = render_cache.misses
+
+    # The body is rendered from the cache.
+    post("handle_activate", "tab-2")
+    assert render_cache.misses == misses
+
+    # Changes within the tab item renew the key.
+    key = body_key()
+    response = post("handle_change", "tab-2-content")
+    assert "Changed" in str(response)
+    assert body_key() != key
+
+    # So do values from the browser.
+    key = body_key()
+    post("handle_activate", "tab-2", **{"tab-2-name": "Jane"})
+    assert body_key() != key
+
+    # Activating keeps the key, changes of the tab item itself renew it.
+    key = body_key()
+    post("handle_activate", "tab-1")
+    post("handle_activate", "tab-2")
+    assert body_key() == key
+    post("handle_grid", "tab-2")
+    assert body_key() != key
+
+
+def test_view_lazy_tab_item_refresh(render_cache):
+    # Changes within a tab item renew its key, hence refreshing the tab item
+    # or the tab renders its body again.
+    for handler, refreshed in (("handle_change_item", "tab-1"), ("handle_change_tab", "tab")):
+        session = SessionStore()
+        _LazyView.as_view()(_request(session))
+        response = _post(_LazyView, session, {
+            "handler": handler, "component_id": "tab-1", "state": "1", "partial": "true",
+        })
+        assert response["html"][0][0] == "#{}".format(refreshed)
+        assert "Changed" in response["html"][0][1]
+
+
+def test_history_copies_data_providers():
+    table = components.Table(id="table", data_provider=_create_data_provider(20), pagination=10)
+    root = components.Group(id="root", initial_components=[table])
+    history = History(root)
+
+    with Journal() as journal:
+        table.touch()
+        table.data_provider.data = _create_data_provider(5).data
+    history.commit(journal, 0, create_state=True)
+
+    assert history.checkout(0).get_component("table").data_provider.total_rows() == 20
+    assert history.checkout(1).get_component("table").data_provider.total_rows() == 5
+
+
+def test_cache_tree_store_requires_shared_cache():
+    with override_settings(CBA_LOCAL_CACHE=False):
+        with pytest.raises(ImproperlyConfigured):
+            CacheTreeStore()
+        with pytest.raises(ImproperlyConfigured):
+            Mailbox("tab")
+
+    store = CacheTreeStore()
+    store.save("tab", History(_create_tree(1)))
+    assert store.load("tab").root.get_component("input-0") is not None
+
+
+class _QuerySetRoot(components.Group):
+    def init_components(self):
+        self.initial_components = [
+            components.Table(
+                id="table", pagination=10,
+                data_provider=components.QuerySetDataProvider(AuthGroup.objects.all(), ["name"])),
+        ]
+
+    def after_initial_components(self):
+        self.get_component("table").load_data()
+
+
+class _QuerySetView(base.CBAView):
+    root = _QuerySetRoot
+
+
+def test_view_table_queryset_queries(db, session):
+    AuthGroup.objects.bulk_create(AuthGroup(name="Group {:02}".format(i)) for i in range(25))
+    _QuerySetView.as_view()(_request(session))
+
+    # One page query and one count, the history is saved without evaluating
+    # the QuerySet.
+    with CaptureQueriesContext(connection) as queries:
+        response = _post(_QuerySetView, session, {
+            "handler": "handle_pagination", "component_id": "table", "component_value": "2",
+            "state": "1", "partial": "true",
+        })
+    assert "Group 10" in response["html"][0][1]
+    assert len(queries) == 2
+    assert sorted("COUNT" in query["sql"] for query in queries) == [False, True]
+
+
+def test_table_data_provider_cache():
+    data_provider = _create_data_provider(25)
+    size = len(pickle.dumps(data_provider, pickle.HIGHEST_PROTOCOL))
+    data_provider.get_rows(0, 10, order_by=1, reverse=True)
+
+    # The cached results are neither pickled nor lost by pickling.
+    assert len(pickle.dumps(data_provider, pickle.HIGHEST_PROTOCOL)) == size
+    data_provider = pickle.loads(pickle.dumps(data_provider, pickle.HIGHEST_PROTOCOL))
+    assert list(data_provider._get_cache()[0]) == [1]
+
+    data_provider.data = data_provider.data[:5]
+    assert data_provider._get_cache() == ({}, {})
+    assert data_provider.total_rows(filters={0: "name"}) == 5
+
+
+def test_table_queryset_page_cache(db, session):
+    AuthGroup.objects.bulk_create(AuthGroup(name="Group {:02}".format(i)) for i in range(25))
+    _request(session)
+
+    data_provider = components.QuerySetDataProvider(AuthGroup.objects.all(), ["name"])
+    with CaptureQueriesContext(connection) as queries:
+        first = data_provider.get_rows(0, 10, order_by=0, reverse=True)
+        assert data_provider.get_rows(0, 10, order_by=0, reverse=True) == first
+    assert len(queries) == 1
+
+    # Other requests query again, unless the pages are cached for a while.
+    _request(session)
+    with CaptureQueriesContext(connection) as queries:
+        data_provider.get_rows(0, 10, order_by=0, reverse=True)
+    assert len(queries) == 1
+
+    data_provider.page_timeout = 60
+    data_provider.get_rows(0, 10)
+    _request(session)
+    with CaptureQueriesContext(connection) as queries:
+        data_provider.get_rows(0, 10)
+    assert len(queries) == 0
+
+
+def test_file_tree_store_clear_expired(tmpdir):
+    store = FileTreeStore(directory=str(tmpdir), timeout=60)
+    store.save("old", History(_create_tree(1)))
+    store.save("new", History(_create_tree(1)))
+    expired = time.time() - 120
+    os.utime(str(tmpdir.join("old.history")), (expired, expired))
+
+    # Expired files are deleted by the next save after the interval.
+    store._cleared = 0
+    store.save("new", History(_create_tree(1)))
+    assert sorted(os.listdir(str(tmpdir))) == ["new.history"]
+
+    os.utime(str(tmpdir.join("new.history")), (expired, expired))
+    set_tree_store(store)
+    try:
+        call_command("clearhistories")
+    finally:
+        set_tree_store(None)
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_tree_stores_save_conditionally(tmpdir):
+    stores = [LocalTreeStore(), FileTreeStore(directory=str(tmpdir)), CacheTreeStore()]
+
+    for store in stores:
+        store.save("tab", History(_create_tree(1)))
+
+        # Two overlapping requests load the same version, the later save
+        # loses.
+        first = store.load("tab")
+        second = store.load("tab")
+        first.root.get_component("input-0").value = "first"
+        first.version += 1
+        second.root.get_component("input-0").value = "second"
+        second.version += 1
+
+        assert store.save("tab", first, 0) is True
+        assert store.save("tab", second, 0) is False
+        assert store.load("tab").root.get_component("input-0").value == "first"
+        assert store.save("tab", second) is True
+        store.delete("tab")
+
+
+class _OverlappingStore(LocalTreeStore):
+    """Stores the history of the tab between loading it and saving it, like
+    an overlapping request.
+    """
+    def load(self, key):
+        history = super(_OverlappingStore, self).load(key)
+        other = super(_OverlappingStore, self).load(key)
+        other.version += 1
+        self.save(key, other)
+        return history
+
+
+class _OverlappingView(base.CBAView):
+    root = _Root
+    tree_store = _OverlappingStore()
+
+
+def test_view_overlapping_requests(session):
+    _OverlappingView.as_view()(_request(session))
+    response = _post(_OverlappingView, session, {
+        "handler": "handle_save", "component_id": "output", "name": "Jane",
+        "state": "1", "create_state": "true", "sequence": "1",
+    })
+    assert response == {"outdated": True}
+
+    history = HistoryStore(_request(session), store=_OverlappingView.tree_store).load()
+    assert history.root.get_component("output").content != "Jane"
+    assert history.state == 0
+
+
+def test_mailbox_take_once():
+    first = Mailbox("tab-take")
+    second = Mailbox("tab-take")
+    for i in range(3):
+        first.submit()
+        first.put(i)
+
+    # A result which has been claimed by another request is not taken again.
+    assert second.cache.add(second._get_key("claim-2"), True)
+    assert first.take() == [0, 2]
+    assert second.take() == []
+    assert first.pending == 1
+
+
+def test_mailbox_wait_out_of_order():
+    mailbox = Mailbox("tab-wait")
+    for i in range(2):
+        mailbox.submit()
+        mailbox.put(i)
+
+    # Another request has taken the first result but not counted it yet.
+    mailbox.cache.delete(mailbox._get_key(1))
+    assert mailbox.wait(0)
+
+    mailbox.cache.delete(mailbox._get_key(2))
+    assert not mailbox.wait(0)
+
+
+def test_mailbox_cache_per_thread():
+    mailbox = Mailbox("tab-thread")
+    caches = []
+    thread = Thread(target=lambda: caches.append(mailbox.cache))
+    thread.start()
+    thread.join()
+    assert caches[0] is not mailbox.cache
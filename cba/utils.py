@@ -1,8 +1,28 @@
 import datetime
 import json
+import re
 from cba import get_request
 from django.utils.encoding import force_unicode
 from django.utils.functional import Promise
+from django.utils.text import compress_string
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# A faster JSON encoder, if one is installed.
+try:
+    import orjson as fast_json
+except ImportError:
+    try:
+        import ujson as fast_json
+    except ImportError:
+        fast_json = None
+
+
+_accepts_brotli = re.compile(r"\bbr\b")
+_accepts_gzip = re.compile(r"\bgzip\b")
 
 
 class LazyEncoder(json.JSONEncoder):
@@ -11,7 +31,46 @@ class LazyEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, Promise):
             return force_unicode(obj)
-        return obj
+        return super(LazyEncoder, self).default(obj)
+
+
+def dumps(data):
+    """Returns the passed data as JSON (bytes). Uses orjson or ujson if one is
+    installed. Data which these can't encode is encoded with ``LazyEncoder``.
+    """
+    if fast_json is not None:
+        try:
+            # ujson encodes lazy strings as lists of characters.
+            result = fast_json.dumps(_force_text(data))
+        except (TypeError, ValueError, OverflowError):
+            pass
+        else:
+            return result if isinstance(result, bytes) else result.encode("utf-8")
+    return json.dumps(data, cls=LazyEncoder, separators=(",", ":")).encode("utf-8")
+
+
+def _force_text(data):
+    """Returns the passed data with lazy strings converted to text.
+    """
+    if isinstance(data, Promise):
+        return force_unicode(data)
+    if isinstance(data, dict):
+        return dict((_force_text(key), _force_text(value)) for key, value in data.items())
+    if isinstance(data, (list, tuple)):
+        return [_force_text(value) for value in data]
+    return data
+
+
+def compress(content, accept_encoding):
+    """Compresses the passed content with brotli (if installed) or gzip,
+    depending on the encodings the browser accepts. Returns the content and
+    the encoding, which is ``None`` if the content isn't compressed.
+    """
+    if brotli is not None and _accepts_brotli.search(accept_encoding):
+        return brotli.compress(content), "br"
+    if _accepts_gzip.search(accept_encoding):
+        return compress_string(content), "gzip"
+    return content, None
 
 
 def time_it(func, logger, log_message, func_args=None):
@@ -0,0 +1,96 @@
+"""An optional WebSocket transport for the events of CBA views, based on
+channels 1.x.
+
+A consumer is created per view and routed within the ``routing.py`` of the
+project, e.g.::
+
+    from channels.routing import route_class
+    from cba.websocket import CBAConsumer
+
+    class MyAppConsumer(CBAConsumer):
+        view = MyAppView
+
+    channel_routing = [
+        route_class(MyAppConsumer, path=r"^/ws/my-app/$"),
+    ]
+
+The view announces the path with ``websocket_url``::
+
+    class MyAppView(CBAView):
+        root = MyAppRoot
+        websocket_url = "/ws/my-app/"
+"""
+from __future__ import absolute_import
+
+import json
+
+from django.http import HttpRequest
+from django.http import QueryDict
+
+import cba
+
+try:
+    from channels.generic.websockets import WebsocketConsumer
+    from channels.security.websockets import allowed_hosts_only
+except ImportError:
+    raise ImportError("cba.websocket requires channels 1.x: pip install 'channels<2'")
+
+
+class CBAConsumer(WebsocketConsumer):
+    """Handles the events of the tabs of a view, which are sent through a
+    WebSocket. The payload is the same as of the ajax requests; the response
+    is the same as of ``CBAView.post``.
+
+    The histories are loaded from and saved to the tree store with every
+    message, like with ajax requests. Hence the messages of a connection can
+    be handled by any worker and mixed with ajax requests of the same tab,
+    e.g. file uploads.
+
+    As the browser sends the cookies of the user with the connection of any
+    site, connections are only accepted from the hosts within
+    ``ALLOWED_HOSTS`` (the ``Origin`` header) and every message has to name
+    its tab.
+
+        view
+            The ``CBAView`` class which handles the events.
+    """
+    http_user_and_session = True
+    view = None
+
+    def connect(self, message, **kwargs):
+        allowed_hosts_only(super(CBAConsumer, self).connect)(message, **kwargs)
+
+    def receive(self, text=None, bytes=None, **kwargs):
+        payload = json.loads(text)
+
+        # Without the tab the history would default to the latest tab of the
+        # session.
+        if not payload["data"].get("tab"):
+            self.send(text=u'{{"id": {}, "result": {{"reload": true}}}}'.format(json.dumps(payload.get("id"))))
+            return
+
+        request = HttpRequest()
+        request.method = "POST"
+        request.path = self.path
+        request.POST = QueryDict(mutable=True)
+        for key, values in payload["data"].items():
+            request.POST.setlist(key, values)
+        request.session = self.message.http_session
+        request.user = self.message.user
+        cba.set_request(request)
+
+        view = self.view()
+        view.request = request
+        view.args = ()
+        view.kwargs = kwargs
+
+        try:
+            response = view.post()
+        finally:
+            cba.set_request(None)
+
+        if request.session.modified:
+            request.session.save()
+
+        self.send(text=u'{{"id": {}, "result": {}}}'.format(
+            json.dumps(payload.get("id")), response.content.decode("utf-8")))
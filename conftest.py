@@ -1,3 +1,5 @@
+import django
+import pytest
 from django.conf import settings
 
 
@@ -12,4 +14,54 @@ def pytest_configure():
             'django.contrib.staticfiles',
             'cba',
         ],
+        TEMPLATES=[
+            {
+                'BACKEND': 'django.template.backends.django.DjangoTemplates',
+                'APP_DIRS': True,
+            },
+        ],
+        DATABASES={
+            'default': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': ':memory:',
+            },
+        },
+        STATIC_URL='/static/',
+        CBA_TREE_STORE='cba.stores.LocalTreeStore',
+        CBA_LOCAL_CACHE=True,
+        SESSION_ENGINE='django.contrib.sessions.backends.cache',
+        SESSION_SERIALIZER='django.contrib.sessions.serializers.PickleSerializer',
     )
+    django.setup()
+
+
+@pytest.fixture
+def db():
+    """Provides the database. Changes are rolled back after the test.
+    """
+    from django.core.management import call_command
+    from django.db import transaction
+    call_command('migrate', verbosity=0)
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+@pytest.fixture
+def session():
+    """Provides an empty session.
+    """
+    from django.contrib.sessions.backends.cache import SessionStore
+    return SessionStore()
+
+
+@pytest.fixture
+def render_cache():
+    """Provides a local render cache, which is used during the test.
+    """
+    from cba.rendering import LocalRenderCache
+    from cba.rendering import set_render_cache
+    cache = LocalRenderCache()
+    set_render_cache(cache)
+    yield cache
+    set_render_cache(None)